@@ -0,0 +1,133 @@
+# Access log for server.py and lab2's server_mt.py (ACCESS_LOG). A request
+# appends one tuple to a bounded deque -- no lock, no formatting, no I/O --
+# and a writer thread turns whatever has piled up into JSON lines and writes
+# them with one os.write every ACCESS_LOG_FLUSH_SEC. When the deque is full the
+# record is dropped and counted instead of slowing the request down.
+#
+# The file is opened with O_APPEND, so the pre-forked workers of server_mt can
+# share it: each batch lands whole. Rotation (path -> path.1 -> path.2 ...)
+# happens under flock, and a writer whose file was rotated by another process
+# notices the changed inode and reopens.
+import collections
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows; rotation is then single-process only
+    fcntl = None
+
+class AccessLog:
+    def __init__(self, path: str, max_bytes: int = 0, backups: int = 5,
+                 queue_size: int = 65536, interval: float = 0.5):
+        self.path = os.path.abspath(path)
+        self.max_bytes = max_bytes       # 0 = never rotate
+        self.backups = max(1, backups)
+        self.queue_size = queue_size
+        self.interval = interval
+        self.records = collections.deque()   # append/popleft are atomic, no lock needed
+        self.dropped = 0
+        self.reported = 0                    # drops already noted in the file
+        self.drop_lock = threading.Lock()    # only taken when a record is dropped
+        self.stop_event = threading.Event()
+        self.fd = -1
+        self.thread = None
+
+    def log(self, ip: str, method: str, path: str, status: int, nbytes: int, seconds: float):
+        # Called on the request path: must stay O(1) and never block
+        if len(self.records) >= self.queue_size:
+            with self.drop_lock:
+                self.dropped += 1
+            return
+        self.records.append((time.time(), ip, method, path, status, nbytes, seconds))
+
+    def start(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._open()
+        self.thread = threading.Thread(target=self._run, name="access-log", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.thread is None:
+            return
+        self.stop_event.set()
+        self.thread.join(self.interval + 1)
+        self.thread = None
+        self.flush()
+        os.close(self.fd)
+        self.fd = -1
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.flush()
+            except OSError as e:
+                print(f"[access-log] write to {self.path} failed: {e!r}", file=sys.stderr)
+
+    def flush(self):
+        lines = []
+        pop = self.records.popleft
+        for _ in range(len(self.records)):
+            ts, ip, method, path, status, nbytes, seconds = pop()
+            lines.append(json.dumps({
+                "ts": format_ts(ts), "ip": ip, "method": method, "path": path,
+                "status": status, "bytes": nbytes, "ms": round(seconds * 1000.0, 3),
+            }, separators=(",", ":")))
+        dropped = self.dropped
+        if dropped != self.reported:
+            lines.append(json.dumps({"ts": format_ts(time.time()), "dropped": dropped - self.reported},
+                                    separators=(",", ":")))
+            self.reported = dropped
+        if not lines:
+            return
+        lines.append("")
+        self._write("\n".join(lines).encode("utf-8", "replace"))
+
+    def _open(self):
+        self.fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+    def _reopen_if_rotated(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            st = None
+        cur = os.fstat(self.fd)
+        if st is None or (st.st_dev, st.st_ino) != (cur.st_dev, cur.st_ino):
+            os.close(self.fd)
+            self._open()
+
+    def _write(self, data: bytes):
+        self._reopen_if_rotated()
+        if self.max_bytes and os.fstat(self.fd).st_size + len(data) > self.max_bytes:
+            self._rotate()
+        view = memoryview(data)
+        while view:
+            view = view[os.write(self.fd, view):]
+
+    def _rotate(self):
+        if fcntl is not None:
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+        try:
+            # Another worker may have rotated while we waited for the lock
+            st = os.stat(self.path)
+            cur = os.fstat(self.fd)
+            if (st.st_dev, st.st_ino) == (cur.st_dev, cur.st_ino) and cur.st_size > 0:
+                for i in range(self.backups - 1, 0, -1):
+                    src = f"{self.path}.{i}"
+                    if os.path.exists(src):
+                        os.replace(src, f"{self.path}.{i + 1}")
+                os.replace(self.path, f"{self.path}.1")
+        except FileNotFoundError:
+            pass
+        finally:
+            if fcntl is not None:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+        os.close(self.fd)
+        self._open()
+
+def format_ts(ts: float) -> str:
+    # 2026-01-31T12:00:00.123Z
+    return time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(ts)) + f".{int(ts % 1 * 1000):03d}Z"
@@ -1,9 +1,107 @@
 import os
 import sys
+import queue
 import socket
+import argparse
+import threading
+import time
 from urllib.parse import urlparse
 
-def http_get(url: str) -> bytes:
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from httpparse import HeadReader, parse_response_head, content_length, is_digits, RECV_SIZE
+from connpool import ConnectionPool
+
+CHUNK_SIZE = 64 * 1024   # bytes per recv / file write while streaming a body
+MAX_LINE = 8192          # chunk-size and trailer lines
+RETRY_STATUSES = {429, 502, 503, 504}
+MAX_RETRY_AFTER = 5.0    # seconds; longer Retry-After values are capped
+
+class IncompleteBody(ConnectionError):
+    # The connection ended before the body the server announced was complete
+    def __init__(self, received: int, expected=None):
+        want = f" of {expected}" if expected is not None else ""
+        super().__init__(f"connection closed after {received}{want} body bytes")
+        self.received = received
+        self.expected = expected
+
+def is_chunked(headers: dict) -> bool:
+    codings = [t.strip().lower() for t in headers.get("transfer-encoding", "").split(",")]
+    return codings[-1] == "chunked"
+
+def read_line(s, reader: HeadReader) -> bytes:
+    # One CRLF-terminated line (without the CRLF) from the buffer, then the socket
+    while True:
+        idx = reader.buf.find(b"\r\n")
+        if idx != -1:
+            return reader.take(idx + 2)[:-2]
+        if len(reader) > MAX_LINE:
+            raise ValueError("chunk line too long")
+        chunk = s.recv(RECV_SIZE)
+        if not chunk:
+            raise IncompleteBody(0)
+        reader.feed(chunk)
+
+def iter_exact(s, reader: HeadReader, n: int):
+    # Yields exactly n bytes: whatever is already buffered, then straight off the socket
+    left = n
+    if left and len(reader):
+        data = reader.take(left)
+        left -= len(data)
+        yield data
+    while left > 0:
+        chunk = s.recv(min(CHUNK_SIZE, left))
+        if not chunk:
+            raise IncompleteBody(n - left, n)
+        left -= len(chunk)
+        yield chunk
+
+def has_body(status: int) -> bool:
+    # 1xx, 204 and 304 responses end with the head whatever their headers say
+    return status >= 200 and status not in (204, 304)
+
+def iter_body(s, reader: HeadReader, headers: dict, status: int = 200):
+    # Yields the body in pieces of at most CHUNK_SIZE bytes. Chunked transfer
+    # coding wins over Content-Length (RFC 9112 6.3); with neither the body ends
+    # at EOF. Raises IncompleteBody when a framed body is cut short.
+    if not has_body(status):
+        return
+    if is_chunked(headers):
+        received = 0
+        try:
+            while True:
+                line = read_line(s, reader)
+                try:
+                    size = int(line.split(b";", 1)[0].strip(), 16)
+                except ValueError:
+                    raise ValueError(f"bad chunk size line {line[:40]!r}")
+                if size == 0:
+                    break
+                for piece in iter_exact(s, reader, size):
+                    received += len(piece)
+                    yield piece
+                if read_line(s, reader) != b"":
+                    raise ValueError("missing CRLF after chunk data")
+            while read_line(s, reader) != b"":   # trailer fields, ignored
+                pass
+        except IncompleteBody:
+            raise IncompleteBody(received) from None
+        return
+
+    length = content_length(headers)
+    if length is not None:
+        yield from iter_exact(s, reader, length)
+        return
+
+    if len(reader):
+        yield reader.take(len(reader))
+    while True:
+        chunk = s.recv(CHUNK_SIZE)
+        if not chunk:
+            return
+        yield chunk
+
+def split_url(url: str):
+    # -> (host, port, request target)
     u = urlparse(url)
     if u.scheme not in ("http", None, ""):
         raise ValueError("Only http:// URLs are supported")
@@ -12,39 +110,272 @@ def http_get(url: str) -> bytes:
     path = u.path if u.path else "/"
     if u.query:
         path += "?" + u.query
+    return host, port, path
+
+def send_get(s, reader: HeadReader, host: str, path: str, keep_alive: bool = False, extra: dict = None):
+    # Writes one GET and reads the response head; returns (status_line, status, headers)
+    fields = "".join(f"{name}: {value}\r\n" for name, value in (extra or {}).items())
+    req = (
+        f"GET {path} HTTP/1.1\r\n"
+        f"Host: {host}\r\n"
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+        f"User-Agent: PR-Lab1-Client/1.0\r\n"
+        f"{fields}"
+        f"\r\n"
+    )
+    s.sendall(req.encode("utf-8"))
+    head = reader.read_head(s)
+    if head is None:
+        raise ConnectionError("Server closed the connection without a response")
+    version, status, reason, headers = parse_response_head(head)
+    return f"{version} {status} {reason}", status, headers
+
+def open_get(url: str):
+    # Sends the request and reads the head; returns (sock, reader, status_line, headers).
+    # The body is still on the socket: pass sock/reader/headers to iter_body or
+    # download, then close the socket.
+    host, port, path = split_url(url)
+    s = socket.create_connection((host, port), timeout=10)
+    try:
+        reader = HeadReader()
+        status_line, _, headers = send_get(s, reader, host, path)
+    except BaseException:
+        s.close()
+        raise
+    return s, reader, status_line, headers
+
+def http_get(url: str):
+    # Returns (status_line, headers, body); header names are lower-cased
+    s, reader, status_line, headers = open_get(url)
+    with s:
+        body = b"".join(iter_body(s, reader, headers))
+    return status_line, headers, body
+
+def download(s, reader: HeadReader, headers: dict, dest: str):
+    # Streams the body into dest.part, then renames it to dest once the size
+    # checks out. Returns (bytes written, seconds). Memory use is one chunk.
+    tmp = dest + ".part"
+    expected = None if is_chunked(headers) else content_length(headers)
+    written = 0
+    start = time.perf_counter()
+    try:
+        with open(tmp, "wb") as f:
+            for piece in iter_body(s, reader, headers):
+                f.write(piece)
+                written += len(piece)
+        if expected is not None and written != expected:
+            raise IncompleteBody(written, expected)
+        os.replace(tmp, dest)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+    return written, time.perf_counter() - start
+
+def format_rate(nbytes: int, seconds: float) -> str:
+    rate = nbytes / seconds if seconds > 0 else 0.0
+    for unit in ("B/s", "KiB/s", "MiB/s"):
+        if rate < 1024 or unit == "MiB/s":
+            return f"{rate:.1f} {unit}"
+        rate /= 1024
 
-    with socket.create_connection((host, port), timeout=10) as s:
-        req = (
-            f"GET {path} HTTP/1.1\r\n"
-            f"Host: {host}\r\n"
-            f"Connection: close\r\n"
-            f"User-Agent: PR-Lab1-Client/1.0\r\n"
-            f"\r\n"
-        )
-        s.sendall(req.encode("utf-8"))
-        data = b""
+# -------------- Batch mode --------------
+
+def response_reusable(status_line: str, status: int, headers: dict) -> bool:
+    # The connection can carry another request if the server keeps it open and
+    # the body had a length we could read to the end of
+    tokens = {t.strip().lower() for t in headers.get("connection", "").split(",")}
+    if "close" in tokens:
+        return False
+    if status_line.startswith("HTTP/1.0") and "keep-alive" not in tokens:
+        return False
+    return not has_body(status) or is_chunked(headers) or content_length(headers) is not None
+
+def retry_delay(attempt: int, headers: dict) -> float:
+    value = headers.get("retry-after", "").strip()
+    if is_digits(value):
+        return min(float(value), MAX_RETRY_AFTER)
+    return min(0.1 * 2 ** attempt, MAX_RETRY_AFTER)
+
+class NameClaims:
+    # Unique file names inside one download directory across worker threads
+    def __init__(self, out_dir: str):
+        self.out_dir = out_dir
+        self.lock = threading.Lock()
+        self.taken = set()
+
+    def claim(self, url: str, ctype: str) -> str:
+        base = os.path.basename(urlparse(url).path)
+        if not base:
+            base = "index" + (infer_extension(ctype) or ".html")
+        stem, ext = os.path.splitext(base)
+        with self.lock:
+            name, n = base, 0
+            while name in self.taken:
+                n += 1
+                name = f"{stem}-{n}{ext}"
+            self.taken.add(name)
+        return os.path.join(self.out_dir, name)
+
+def pooled_get(pool: ConnectionPool, url: str, retries: int, consume, extra: dict = None) -> dict:
+    # GET over a pooled connection. consume(sock, reader, status, headers) must
+    # read the whole body and returns a dict merged into the result. Connection
+    # errors, truncated bodies and RETRY_STATUSES are retried up to `retries`
+    # times; a reused connection the server already closed is retried for free.
+    result = {"url": url, "status": None, "bytes": 0, "attempts": 0, "reused": False,
+              "path": None, "error": None}
+    start = time.perf_counter()
+    try:
+        host, port, path = split_url(url)
+    except ValueError as e:
+        result["error"] = str(e)
+        result["seconds"] = 0.0
+        return result
+    failures = 0
+    while True:
+        result["attempts"] += 1
+        delay = None
+        reusable = False
+        try:
+            conn = pool.acquire(host, port)
+        except OSError as e:
+            conn, err = None, e
+        if conn is not None:
+            reused = conn.requests > 0
+            err = None
+            answered = False
+            try:
+                status_line, status, headers = send_get(conn.sock, conn.reader, host, path,
+                                                        keep_alive=True, extra=extra)
+                answered = True
+                conn.requests += 1
+                result.update(status=status, reused=reused, error=None)
+                if status in RETRY_STATUSES:
+                    for _ in iter_body(conn.sock, conn.reader, headers):
+                        pass
+                    delay = retry_delay(failures, headers)
+                else:
+                    result.update(consume(conn.sock, conn.reader, status, headers))
+                reusable = response_reusable(status_line, status, headers)
+            except (OSError, ValueError) as e:   # IncompleteBody and HeadError included
+                err = e
+            finally:
+                pool.release(conn, reusable)
+            if err is not None and reused and not answered:
+                result["attempts"] -= 1   # stale keep-alive connection, not the server's fault
+                continue
+        if err is not None:
+            result["status"] = None
+            result["error"] = f"{type(err).__name__}: {err}"
+            delay = retry_delay(failures, {})
+        if delay is None or failures >= retries:
+            break
+        failures += 1
+        time.sleep(delay)
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+def fetch_one(pool: ConnectionPool, url: str, names: NameClaims, retries: int) -> dict:
+    # Saves one URL (200 only) into the batch's download directory. The name is
+    # claimed on the first 200 (it may need the content type) and kept for retries,
+    # so a failed attempt does not push the file to "name-1.ext".
+    claimed = []
+    def consume(sock, reader, status, headers):
+        if status != 200:
+            for _ in iter_body(sock, reader, headers, status):
+                pass
+            return {}
+        if not claimed:
+            claimed.append(names.claim(url, headers.get("content-type", "")))
+        dest = claimed[0]
+        nbytes, _ = download(sock, reader, headers, dest)
+        return {"bytes": nbytes, "path": dest}
+    return pooled_get(pool, url, retries, consume)
+
+def format_result(r: dict) -> str:
+    status = r["status"] if r["status"] is not None else "ERR"
+    conn = "reused" if r["reused"] else "new"
+    line = f"{status:>3} {r['seconds'] * 1000:9.1f} ms {r['bytes']:>11} B  {conn:<6} {r['url']}"
+    if r["attempts"] > 1:
+        line += f"  ({r['attempts']} attempts)"
+    if r["error"]:
+        line += f"  {r['error']}"
+    return line
+
+def fetch_batch(urls, out_dir: str, concurrency: int = 8, per_host: int = 4,
+                retries: int = 2, timeout: float = 10.0, verbose: bool = True):
+    # Fetches every URL with `concurrency` worker threads sharing one pool;
+    # returns (results in input order, wall seconds, pool)
+    os.makedirs(out_dir, exist_ok=True)
+    pool = ConnectionPool(per_host, timeout)
+    names = NameClaims(out_dir)
+    todo = queue.Queue()
+    for item in enumerate(urls):
+        todo.put(item)
+    results = [None] * len(urls)
+    print_lock = threading.Lock()
+
+    def worker():
         while True:
-            chunk = s.recv(65536)
-            if not chunk:
-                break
-            data += chunk
-    return data
-
-def split_head_body(resp: bytes):
-    head, sep, body = resp.partition(b"\r\n\r\n")
-    return head, body
-
-def parse_headers(head: bytes):
-    lines = head.decode("iso-8859-1", "replace").split("\r\n")
-    status_line = lines[0] if lines else ""
-    headers = {}
-    for line in lines[1:]:
-        if not line.strip():
-            continue
-        if ":" in line:
-            k, v = line.split(":", 1)
-            headers[k.strip().lower()] = v.strip()
-    return status_line, headers
+            try:
+                i, url = todo.get_nowait()
+            except queue.Empty:
+                return
+            r = fetch_one(pool, url, names, retries)
+            results[i] = r
+            if verbose:
+                with print_lock:
+                    print(format_result(r), flush=True)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(max(1, min(concurrency, len(urls))))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - start
+    pool.close()
+    return results, wall, pool
+
+def print_batch_summary(results, wall: float, pool: ConnectionPool):
+    ok = [r for r in results if r["status"] == 200]
+    total = sum(r["bytes"] for r in ok)
+    times = sorted(r["seconds"] * 1000 for r in results)
+    pick = lambda q: times[min(len(times) - 1, int(q * len(times)))] if times else 0.0
+    print(f"-- {len(results)} URLs: {len(ok)} saved, {len(results) - len(ok)} failed | "
+          f"{total} bytes in {wall:.3f}s ({len(results) / wall if wall else 0:.1f} req/s, "
+          f"{format_rate(total, wall)})")
+    print(f"-- latency ms: p50 {pick(0.5):.1f} | p90 {pick(0.9):.1f} | max {pick(1.0):.1f} | "
+          f"connections: {pool.opened} opened, {pool.reused} reuses")
+
+def read_url_file(path: str):
+    f = sys.stdin if path == "-" else open(path, "r", encoding="utf-8")
+    with f:
+        return [line.strip() for line in f if line.strip() and not line.lstrip().startswith("#")]
+
+def batch_main(argv) -> int:
+    ap = argparse.ArgumentParser(prog="client.py batch",
+                                 description="Fetch many URLs concurrently over keep-alive connections")
+    ap.add_argument("download_dir")
+    ap.add_argument("urls", nargs="*", help="URLs to fetch")
+    ap.add_argument("-f", "--file", action="append", default=[], help="File with one URL per line ('-' = stdin)")
+    ap.add_argument("-c", "--concurrency", type=int, default=8, help="Requests in flight (default 8)")
+    ap.add_argument("--per-host", type=int, default=4, help="Connections per host (default 4)")
+    ap.add_argument("--retries", type=int, default=2, help="Retries on connection errors and 429/5xx (default 2)")
+    ap.add_argument("--timeout", type=float, default=10.0, help="Socket timeout in seconds (default 10)")
+    args = ap.parse_intermixed_args(argv)
+
+    urls = list(args.urls)
+    for path in args.file:
+        urls += read_url_file(path)
+    if not urls:
+        ap.error("no URLs given")
+    results, wall, pool = fetch_batch(urls, args.download_dir, args.concurrency, args.per_host,
+                                      args.retries, args.timeout)
+    print_batch_summary(results, wall, pool)
+    return 0 if all(r["status"] == 200 for r in results) else 1
 
 def infer_extension(ct: str) -> str:
     ct = (ct or "").split(";")[0].strip().lower()
@@ -57,8 +388,19 @@ def infer_extension(ct: str) -> str:
     return ""
 
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "batch":
+        sys.exit(batch_main(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == "segmented":
+        import segmented
+        sys.exit(segmented.segmented_main(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == "mirror":
+        import mirror
+        sys.exit(mirror.mirror_main(sys.argv[2:]))
     if len(sys.argv) != 3:
         print("Usage: python client.py <URL> <download_dir>", file=sys.stderr)
+        print("       python client.py batch <download_dir> [URL ...] [-f urls.txt] [-c N]", file=sys.stderr)
+        print("       python client.py segmented <URL> <download_dir> [-n N]", file=sys.stderr)
+        print("       python client.py mirror <directory URL> <download_dir> [-c N]", file=sys.stderr)
         print("HTML -> print body to stdout")
         print("PNG/PDF -> save into <download_dir>", file=sys.stderr)
         sys.exit(2)
@@ -68,30 +410,33 @@ def main():
 
     os.makedirs(out_dir, exist_ok=True)
 
-    resp = http_get(url)
-    head, body = split_head_body(resp)
-    status_line, headers = parse_headers(head)
-    print(status_line)
+    s, reader, status_line, headers = open_get(url)
+    with s:
+        print(status_line)
 
-    ctype = headers.get("content-type", "")
-    ext = infer_extension(ctype)
+        ctype = headers.get("content-type", "")
+        ext = infer_extension(ctype)
 
-    if ext == ".html":
-        try:
-            print(body.decode("utf-8"))
-        except UnicodeDecodeError:
-            print(body.decode("iso-8859-1", "replace"))
-    elif ext in (".png", ".pdf"):
-        parsed = urlparse(url)
-        base = os.path.basename(parsed.path) or ("download" + ext)
-        if not base.lower().endswith(ext):
-            base += ext
-        dest = os.path.join(out_dir, base)
-        with open(dest, "wb") as f:
-            f.write(body)
-        print(f"Saved: {dest}")
-    else:
-        print("Unknown or unsupported content type; nothing saved.", file=sys.stderr)
+        if ext == ".html":
+            body = b"".join(iter_body(s, reader, headers))
+            try:
+                print(body.decode("utf-8"))
+            except UnicodeDecodeError:
+                print(body.decode("iso-8859-1", "replace"))
+        elif ext in (".png", ".pdf"):
+            parsed = urlparse(url)
+            base = os.path.basename(parsed.path) or ("download" + ext)
+            if not base.lower().endswith(ext):
+                base += ext
+            dest = os.path.join(out_dir, base)
+            try:
+                nbytes, seconds = download(s, reader, headers, dest)
+            except (IncompleteBody, ValueError) as e:
+                print(f"Download failed: {e}", file=sys.stderr)
+                sys.exit(1)
+            print(f"Saved: {dest} ({nbytes} bytes in {seconds:.3f}s, {format_rate(nbytes, seconds)})")
+        else:
+            print("Unknown or unsupported content type; nothing saved.", file=sys.stderr)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,66 @@
+import zlib
+
+try:
+    import brotli  # optional: pip install brotli
+except ImportError:
+    brotli = None
+
+# Already-compressed formats (PNG, PDF, archives, ...) are never re-encoded
+COMPRESSIBLE_TYPES = ("text/", "application/json", "application/javascript",
+                      "application/xml", "image/svg+xml")
+
+ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)   # server preference order
+
+def compressible(ctype: str) -> bool:
+    ctype = (ctype or "").split(";")[0].strip().lower()
+    return ctype.startswith(COMPRESSIBLE_TYPES)
+
+def negotiate(accept_encoding: str, available=ENCODINGS):
+    # Picks the best coding from an Accept-Encoding header, or None for identity
+    if not accept_encoding:
+        return None
+    q = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        weight = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+        q[name] = weight
+    best, best_q = None, 0.0
+    for enc in available:
+        weight = q.get(enc, q.get("*", 0.0))
+        if weight > best_q:
+            best, best_q = enc, weight
+    return best
+
+def compressor(encoding: str, level: int):
+    if encoding == "br":
+        c = brotli.Compressor(quality=min(level, 11))
+        return c.process, c.finish
+    c = zlib.compressobj(level, zlib.DEFLATED, 31)   # wbits=31 -> gzip container
+    return c.compress, c.flush
+
+def compress_bytes(data: bytes, encoding: str, level: int = 6) -> bytes:
+    feed, finish = compressor(encoding, level)
+    return feed(data) + finish()
+
+def compress_chunks(chunks, encoding: str, level: int = 6):
+    # Compresses an iterable of str/bytes piece by piece, so the uncompressed
+    # document never has to exist as one buffer; yields non-empty bytes chunks
+    feed, finish = compressor(encoding, level)
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode("utf-8")
+        out = feed(chunk)
+        if out:
+            yield out
+    out = finish()
+    if out:
+        yield out
@@ -0,0 +1,72 @@
+# Persistent connections for client.py's batch mode. Each (host, port) has a
+# semaphore that caps how many connections to it are open at once and a stack
+# of idle ones; a fetch borrows a connection, and gives it back only if the
+# response left it reusable (framed body, no "Connection: close").
+import socket
+import threading
+
+from httpparse import HeadReader
+
+class PooledConnection:
+    def __init__(self, key, sock):
+        self.key = key
+        self.sock = sock
+        self.reader = HeadReader()   # may hold bytes of the next response on a reused connection
+        self.requests = 0            # responses already read on this socket
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+class ConnectionPool:
+    def __init__(self, per_host: int = 4, timeout: float = 10.0):
+        self.per_host = max(1, per_host)
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.idle = {}      # (host, port) -> [PooledConnection], most recently used last
+        self.slots = {}     # (host, port) -> BoundedSemaphore(per_host)
+        self.opened = 0
+        self.reused = 0
+
+    def _slot(self, key):
+        with self.lock:
+            slot = self.slots.get(key)
+            if slot is None:
+                slot = self.slots[key] = threading.BoundedSemaphore(self.per_host)
+            return slot
+
+    def acquire(self, host: str, port: int) -> PooledConnection:
+        # Blocks while per_host connections to this host are already checked out
+        key = (host, port)
+        self._slot(key).acquire()
+        with self.lock:
+            stack = self.idle.get(key)
+            if stack:
+                self.reused += 1
+                return stack.pop()
+        try:
+            sock = socket.create_connection(key, timeout=self.timeout)
+        except BaseException:
+            self._slot(key).release()
+            raise
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with self.lock:
+            self.opened += 1
+        return PooledConnection(key, sock)
+
+    def release(self, conn: PooledConnection, reusable: bool):
+        if reusable:
+            with self.lock:
+                self.idle.setdefault(conn.key, []).append(conn)
+        else:
+            conn.close()
+        self._slot(conn.key).release()
+
+    def close(self):
+        with self.lock:
+            stacks, self.idle = list(self.idle.values()), {}
+        for stack in stacks:
+            for conn in stack:
+                conn.close()
@@ -0,0 +1,112 @@
+import os
+import threading
+from collections import OrderedDict
+
+class FileCache:
+    # Byte-bounded LRU of file contents, revalidated against os.stat mtime/size
+    def __init__(self, max_bytes: int, max_file_bytes: int):
+        self.max_bytes = max_bytes
+        self.max_file_bytes = max_file_bytes
+        self.entries = OrderedDict()  # abs_path -> (mtime_ns, size, data)
+        self.total = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def lookup(self, abs_path: str, st=None):
+        # Returns (data, st); data is None when the file is not cacheable
+        if st is None:
+            st = os.stat(abs_path)
+        if not self.enabled:
+            return None, st
+        key = (st.st_mtime_ns, st.st_size)
+        data = self.get(abs_path, key)
+        if data is not None:
+            return data, st
+
+        if st.st_size > self.max_file_bytes or st.st_size > self.max_bytes:
+            return None, st
+        with open(abs_path, "rb") as f:
+            data = f.read()
+        if len(data) != st.st_size:   # changed while reading; serve it but don't keep it
+            return data, st
+        self.put(abs_path, key, data)
+        return data, st
+
+    def get(self, name, key):
+        # Cached bytes for `name` if stored under the same (mtime_ns, size) key
+        with self.lock:
+            entry = self.entries.get(name)
+            if entry is not None and entry[:2] == key:
+                self.entries.move_to_end(name)
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+        return None
+
+    def put(self, abs_path: str, key, data: bytes):
+        with self.lock:
+            old = self.entries.pop(abs_path, None)
+            if old is not None:
+                self.total -= len(old[2])
+            self.entries[abs_path] = (key[0], key[1], data)
+            self.total += len(data)
+            while self.total > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.total -= len(evicted[2])
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.total,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+def scan_dir(absdir: str):
+    # (name, is_dir) pairs sorted like the listings show them; d_type from
+    # os.scandir saves the per-entry stat that os.path.isdir would cost
+    with os.scandir(absdir) as it:
+        entries = [(e.name, e.is_dir()) for e in it]
+    entries.sort(key=lambda e: e[0].lower())
+    return entries
+
+class DirCache:
+    # Built listing data per (directory, key), invalidated on directory mtime
+    def __init__(self, max_dirs: int = 1024):
+        self.max_dirs = max_dirs
+        self.entries = OrderedDict()  # (absdir, key) -> (mtime_ns, value)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, absdir: str, key, build, mtime: int = None):
+        # build(entries) turns a scan_dir() result into whatever the caller caches;
+        # mtime saves the os.stat when the caller already knows it
+        if mtime is None:
+            mtime = os.stat(absdir).st_mtime_ns
+        ck = (absdir, key)
+        with self.lock:
+            entry = self.entries.get(ck)
+            if entry is not None and entry[0] == mtime:
+                self.entries.move_to_end(ck)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        value = build(scan_dir(absdir))
+        with self.lock:
+            self.entries[ck] = (mtime, value)
+            self.entries.move_to_end(ck)
+            while len(self.entries) > self.max_dirs:
+                self.entries.popitem(last=False)
+        return value
@@ -0,0 +1,127 @@
+# HTTP/1.x message-head parsing shared by server.py, lab2's server_mt.py and
+# client.py. HeadReader keeps what came off the socket in one bytearray and
+# only scans the bytes that arrived since the last look for the blank line;
+# parse_request_head / parse_response_head then split a complete head into a
+# dict of lower-cased header names exactly once.
+MAX_HEADER_BYTES = 65536   # request line + headers
+MAX_HEADERS = 100          # header fields per message
+RECV_SIZE = 4096
+MAX_LENGTH_DIGITS = 18     # Content-Length digits; 10**18 bytes is past any real body, and int() refuses > 4300
+
+class HeadError(ValueError):
+    # A head the peer should not have sent; status/reason are what a server answers with
+    def __init__(self, status: int, reason: str):
+        super().__init__(f"{status} {reason}")
+        self.status = status
+        self.reason = reason
+
+def is_digits(value: str) -> bool:
+    # str.isdigit() also accepts '²', '١' and friends, which int() then rejects
+    return value.isascii() and value.isdigit()
+
+def too_large() -> HeadError:
+    return HeadError(431, "Request Header Fields Too Large")
+
+class HeadReader:
+    def __init__(self, max_bytes: int = MAX_HEADER_BYTES):
+        self.buf = bytearray()
+        self.scan = 0              # everything before this offset is known to hold no CRLFCRLF
+        self.max_bytes = max_bytes
+
+    def __len__(self) -> int:
+        return len(self.buf)
+
+    def feed(self, data: bytes):
+        self.buf += data
+
+    def next_head(self):
+        # Pops one complete head (without the blank line) off the buffer, or None
+        idx = self.buf.find(b"\r\n\r\n", self.scan)
+        if idx == -1:
+            if len(self.buf) > self.max_bytes:
+                raise too_large()
+            self.scan = max(0, len(self.buf) - 3)
+            return None
+        if idx > self.max_bytes:
+            raise too_large()
+        head = bytes(self.buf[:idx])
+        del self.buf[:idx + 4]     # bytearray drops a prefix without moving the rest
+        self.scan = 0
+        return head
+
+    def read_head(self, sock):
+        # Receives until a head is buffered. Pipelined requests that came in the
+        # same recv stay buffered for the next call. On EOF the unterminated
+        # remainder is returned as is (None if there was nothing).
+        while True:
+            head = self.next_head()
+            if head is not None:
+                return head
+            chunk = sock.recv(RECV_SIZE)
+            if not chunk:
+                return self.take(len(self.buf)).rstrip(b"\r\n") or None
+            self.feed(chunk)
+
+    def take(self, n: int) -> bytes:
+        # Pops up to n already-buffered bytes (a message body)
+        data = bytes(self.buf[:n])
+        del self.buf[:n]
+        self.scan = 0
+        return data
+
+def parse_fields(lines, max_headers: int = MAX_HEADERS) -> dict:
+    if len(lines) > max_headers:
+        raise too_large()
+    headers = {}
+    for line in lines:
+        name, sep, value = line.partition(":")
+        # No name, whitespace before the colon, or obsolete line folding
+        if not sep or not name or name[-1] in " \t" or name[0] in " \t":
+            raise HeadError(400, "Bad Request")
+        name = name.lower()
+        value = value.strip(" \t")
+        prev = headers.get(name)
+        headers[name] = value if prev is None else prev + ", " + value
+    return headers
+
+def split_head(head: bytes):
+    # Latin-1 maps every byte, so this never fails and is a single copy
+    lines = head.decode("iso-8859-1").split("\r\n")
+    return lines[0], lines[1:]
+
+def parse_request_head(head: bytes, max_headers: int = MAX_HEADERS):
+    # Returns (method, target, version, headers); raises HeadError
+    start, lines = split_head(head.lstrip(b"\r\n"))   # stray CRLFs between requests are allowed
+    parts = start.split(" ")
+    if len(parts) != 3 or not parts[0] or not parts[1] or not parts[2].startswith("HTTP/"):
+        raise HeadError(400, "Bad Request")
+    method, target, version = parts
+    headers = parse_fields(lines, max_headers)
+    if version == "HTTP/1.1" and "host" not in headers:
+        raise HeadError(400, "Bad Request")
+    if "transfer-encoding" in headers:
+        # The servers frame request bodies by Content-Length only; a chunked body
+        # left in the buffer would be parsed as the next, smuggled, request
+        raise HeadError(501, "Not Implemented")
+    if "content-length" in headers and content_length(headers) is None:
+        raise HeadError(400, "Bad Request")   # the body could not be framed
+    return method, target, version, headers
+
+def parse_response_head(head: bytes, max_headers: int = MAX_HEADERS):
+    # Returns (version, status, reason, headers); raises HeadError
+    start, lines = split_head(head)
+    version, _, rest = start.partition(" ")
+    code, _, reason = rest.partition(" ")
+    if not version.startswith("HTTP/") or len(code) != 3 or not is_digits(code):
+        raise HeadError(400, "Bad Request")
+    return version, int(code), reason, parse_fields(lines, max_headers)
+
+def content_length(headers: dict):
+    # Declared body length, or None when absent or unusable
+    value = headers.get("content-length")
+    if value is None:
+        return None
+    value = value.split(",")[0].strip()   # repeated identical headers were joined above
+    if len(value) > MAX_LENGTH_DIGITS or not is_digits(value):
+        return None
+    return int(value)
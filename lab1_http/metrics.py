@@ -0,0 +1,215 @@
+# Request metrics for server.py and lab2's server_mt.py, exposed as Prometheus
+# text and JSON. Every thread records into its own shard (plain dicts reached
+# through threading.local), so the request path never takes a shared lock; a
+# scrape copies the shards and merges them. Numbers that already live
+# elsewhere (cache stats, hit counters, rate-limit rejections, pool state) are
+# registered as sources and read only when scraped.
+import bisect
+import json
+import threading
+import time
+
+# Upper bounds in seconds, as in the Prometheus client defaults plus sub-ms steps
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+MAX_PATHS = 512            # distinct path labels per shard; the rest count as OTHER_PATH
+OTHER_PATH = "(other)"
+UNMATCHED_PATH = "(404)"   # not-found paths are attacker-controlled, so they share one label
+
+class _Shard:
+    def __init__(self):
+        self.requests = {}     # (path, status) -> count
+        self.latency = {}      # path -> [bucket counts..., +Inf count]
+        self.latency_sum = {}  # path -> seconds
+        self.bytes = {}        # path -> bytes sent
+        self.opened = 0
+        self.closed = 0
+
+class Metrics:
+    def __init__(self):
+        self._local = threading.local()
+        self._shards = []
+        self._lock = threading.Lock()   # taken once per thread, when its shard is created
+        self._sources = []              # (name, kind, doc, label, fn)
+        self.started = time.time()
+
+    def _shard(self) -> _Shard:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = _Shard()
+            with self._lock:
+                self._shards.append(shard)
+        return shard
+
+    def observe(self, path: str, status: int, seconds: float, nbytes: int):
+        sh = self._shard()
+        if status == 404:
+            path = UNMATCHED_PATH
+        elif path not in sh.latency and len(sh.latency) >= MAX_PATHS:
+            path = OTHER_PATH
+        key = (path, status)
+        sh.requests[key] = sh.requests.get(key, 0) + 1
+        buckets = sh.latency.get(path)
+        if buckets is None:
+            buckets = sh.latency[path] = [0] * (len(LATENCY_BUCKETS) + 1)
+        buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        sh.latency_sum[path] = sh.latency_sum.get(path, 0.0) + seconds
+        sh.bytes[path] = sh.bytes.get(path, 0) + nbytes
+
+    def connection_opened(self):
+        self._shard().opened += 1
+
+    def connection_closed(self):
+        self._shard().closed += 1
+
+    def add_source(self, name: str, kind: str, doc: str, fn, label: str = None):
+        # fn() returns a number, or {label value: number} when `label` is given
+        self._sources.append((name, kind, doc, label, fn))
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            shards = list(self._shards)
+        requests, latency, latency_sum, sent = {}, {}, {}, {}
+        opened = closed = 0
+        for sh in shards:
+            # dict.copy() runs in C under the GIL, so it never sees a half-applied update
+            for key, n in sh.requests.copy().items():
+                requests[key] = requests.get(key, 0) + n
+            for path, counts in sh.latency.copy().items():
+                acc = latency.setdefault(path, [0] * len(counts))
+                for i, n in enumerate(list(counts)):
+                    acc[i] += n
+            for path, v in sh.latency_sum.copy().items():
+                latency_sum[path] = latency_sum.get(path, 0.0) + v
+            for path, v in sh.bytes.copy().items():
+                sent[path] = sent.get(path, 0) + v
+            opened += sh.opened
+            closed += sh.closed
+        sources = {}
+        for name, kind, doc, label, fn in self._sources:
+            try:
+                sources[name] = fn()
+            except Exception:   # a broken source must not break the scrape
+                continue
+        return {
+            "uptime_seconds": time.time() - self.started,
+            "requests": requests,
+            "latency": latency,
+            "latency_sum": latency_sum,
+            "bytes": sent,
+            "connections_opened": opened,
+            "connections_closed": closed,
+            "sources": sources,
+        }
+
+    def prometheus(self) -> bytes:
+        snap = self.snapshot()
+        out = []
+
+        def family(name, kind, doc):
+            out.append(f"# HELP {name} {doc}")
+            out.append(f"# TYPE {name} {kind}")
+
+        family("http_requests_total", "counter", "Requests served, by path and status.")
+        for (path, status), n in sorted(snap["requests"].items()):
+            out.append(f'http_requests_total{{path="{escape_label(path)}",status="{status}"}} {n}')
+
+        family("http_request_duration_seconds", "histogram", "Time from parsed request to response sent.")
+        for path, counts in sorted(snap["latency"].items()):
+            p = escape_label(path)
+            total = 0
+            for bound, n in zip(LATENCY_BUCKETS, counts):
+                total += n
+                out.append(f'http_request_duration_seconds_bucket{{path="{p}",le="{bound:g}"}} {total}')
+            total += counts[-1]
+            out.append(f'http_request_duration_seconds_bucket{{path="{p}",le="+Inf"}} {total}')
+            out.append(f'http_request_duration_seconds_sum{{path="{p}"}} {snap["latency_sum"].get(path, 0.0):.6f}')
+            out.append(f'http_request_duration_seconds_count{{path="{p}"}} {total}')
+
+        family("http_response_bytes_total", "counter", "Response bytes sent (head and body), by path.")
+        for path, n in sorted(snap["bytes"].items()):
+            out.append(f'http_response_bytes_total{{path="{escape_label(path)}"}} {n}')
+
+        family("http_connections_active", "gauge", "Client connections currently open.")
+        out.append(f"http_connections_active {snap['connections_opened'] - snap['connections_closed']}")
+        family("http_connections_total", "counter", "Client connections accepted.")
+        out.append(f"http_connections_total {snap['connections_opened']}")
+
+        for name, kind, doc, label, _ in self._sources:
+            if name not in snap["sources"]:
+                continue
+            value = snap["sources"][name]
+            family(name, kind, doc)
+            if label is None:
+                out.append(f"{name} {value:g}")
+            else:
+                for k, v in sorted(value.items()):
+                    out.append(f'{name}{{{label}="{escape_label(str(k))}"}} {v:g}')
+
+        family("process_uptime_seconds", "gauge", "Seconds since the server started.")
+        out.append(f"process_uptime_seconds {snap['uptime_seconds']:.3f}")
+        return ("\n".join(out) + "\n").encode("utf-8")
+
+    def json(self) -> bytes:
+        snap = self.snapshot()
+        routes = {}
+        for (path, status), n in snap["requests"].items():
+            r = routes.setdefault(path, {"requests": {}, "bytes": snap["bytes"].get(path, 0)})
+            r["requests"][str(status)] = n
+        for path, counts in snap["latency"].items():
+            r = routes.setdefault(path, {"requests": {}, "bytes": snap["bytes"].get(path, 0)})
+            count = sum(counts)
+            r["latency_ms"] = {
+                "count": count,
+                "mean": round(1000.0 * snap["latency_sum"].get(path, 0.0) / count, 3) if count else 0.0,
+                "p50": round(1000.0 * bucket_quantile(counts, 0.50), 3),
+                "p90": round(1000.0 * bucket_quantile(counts, 0.90), 3),
+                "p99": round(1000.0 * bucket_quantile(counts, 0.99), 3),
+            }
+        doc = {
+            "uptime_seconds": round(snap["uptime_seconds"], 3),
+            "connections": {
+                "active": snap["connections_opened"] - snap["connections_closed"],
+                "total": snap["connections_opened"],
+            },
+            "routes": routes,
+            **snap["sources"],
+        }
+        return json.dumps(doc, indent=2, sort_keys=True).encode("utf-8")
+
+def bucket_quantile(counts, q: float) -> float:
+    # Linear interpolation inside the bucket holding the q-th observation,
+    # like Prometheus' histogram_quantile(); the +Inf bucket reports its lower bound
+    total = sum(counts)
+    if not total:
+        return 0.0
+    rank = q * total
+    seen = 0
+    for i, n in enumerate(counts):
+        if n and seen + n >= rank:
+            if i == len(LATENCY_BUCKETS):
+                return LATENCY_BUCKETS[-1]
+            lo = LATENCY_BUCKETS[i - 1] if i else 0.0
+            return lo + (LATENCY_BUCKETS[i] - lo) * (rank - seen) / n
+        seen += n
+    return LATENCY_BUCKETS[-1]
+
+def escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def response_status(resp) -> int:
+    # b"HTTP/1.1 200 ..." -> 200, for bytes responses and FileResponse heads alike
+    head = resp if isinstance(resp, (bytes, bytearray)) else resp.head
+    try:
+        return int(head[9:12])
+    except ValueError:
+        return 0
+
+def response_size(resp) -> int:
+    if isinstance(resp, (bytes, bytearray)):
+        return len(resp)
+    return len(resp.head) + sum(p[1] if isinstance(p, tuple) else len(p) for p in resp.parts)
+
+def cache_ratio(hits: int, misses: int) -> float:
+    lookups = hits + misses
+    return hits / lookups if lookups else 0.0
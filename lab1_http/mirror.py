@@ -0,0 +1,228 @@
+# Mirror mode for client.py ("python client.py mirror URL DIR"). Starting from
+# a directory URL, listing pages are parsed for links and walked breadth-first
+# by a fixed set of worker threads sharing client.py's keep-alive pool. Files
+# are saved under DIR with the same relative paths. A manifest (DIR/.mirror.json)
+# remembers each file's ETag / Last-Modified / size, so a rerun sends
+# conditional requests and the server answers 304 for everything unchanged.
+import argparse
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from html.parser import HTMLParser
+from urllib.parse import urljoin, urlparse, unquote
+
+from connpool import ConnectionPool
+from client import pooled_get, iter_body, download, format_rate
+
+MANIFEST = ".mirror.json"
+DEFAULT_EXTS = (".html", ".png", ".pdf")   # what the lab servers serve
+MAX_LISTING_BYTES = 16 * 1024 * 1024
+
+class LinkParser(HTMLParser):
+    def __init__(self):
+        super().__init__()
+        self.links = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "a":
+            href = dict(attrs).get("href")
+            if href:
+                self.links.append(href)
+
+def listing_links(base_url: str, html: str):
+    parser = LinkParser()
+    parser.feed(html)
+    parser.close()
+    return [urljoin(base_url, href) for href in parser.links]
+
+class Mirror:
+    def __init__(self, root_url: str, out_dir: str, workers: int = 8, per_host: int = 4,
+                 retries: int = 2, exts=DEFAULT_EXTS, timeout: float = 10.0):
+        if not urlparse(root_url).path.endswith("/"):
+            root_url += "/"
+        self.root = root_url
+        root = urlparse(root_url)
+        self.origin = (root.scheme, root.netloc)
+        self.root_path = root.path
+        self.out_dir = os.path.abspath(out_dir)
+        self.workers = workers
+        self.retries = retries
+        self.exts = tuple(e.lower() for e in exts)
+        self.pool = ConnectionPool(per_host, timeout)
+        self.todo = queue.Queue()
+        self.lock = threading.Lock()
+        self.seen = set()
+        self.manifest = {}
+        self.stats = {"dirs": 0, "saved": 0, "unchanged": 0, "skipped": 0, "failed": 0, "bytes": 0}
+
+    # ---- manifest ----
+
+    def load_manifest(self):
+        try:
+            with open(os.path.join(self.out_dir, MANIFEST), "r", encoding="utf-8") as f:
+                self.manifest = json.load(f)
+        except (OSError, ValueError):
+            self.manifest = {}
+
+    def save_manifest(self):
+        path = os.path.join(self.out_dir, MANIFEST)
+        with self.lock:
+            doc = dict(self.manifest)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(doc, f, indent=1, sort_keys=True)
+        os.replace(path + ".tmp", path)
+
+    # ---- walking ----
+
+    def local_path(self, url: str):
+        # DIR/<path below the root>, or None if it would land outside DIR
+        rel = unquote(urlparse(url).path[len(self.root_path):])
+        dest = os.path.normpath(os.path.join(self.out_dir, rel))
+        if dest != self.out_dir and not dest.startswith(self.out_dir + os.sep):
+            return None
+        return rel, dest
+
+    def enqueue(self, url: str):
+        u = urlparse(url)
+        url = u._replace(query="", fragment="").geturl()
+        if (u.scheme, u.netloc) != self.origin or not u.path.startswith(self.root_path):
+            return   # other hosts and the parent-directory link
+        with self.lock:
+            if url in self.seen:
+                return
+            self.seen.add(url)
+        if u.path.endswith("/"):
+            self.todo.put(("dir", url))
+        elif u.path.lower().endswith(self.exts):
+            self.todo.put(("file", url))
+        else:
+            self.count("skipped")
+
+    def count(self, key: str, n: int = 1):
+        with self.lock:
+            self.stats[key] += n
+
+    def report(self, status, url: str, note: str = ""):
+        print(f"{status:>4} {url}{'  ' + note if note else ''}", flush=True)
+
+    def crawl_dir(self, url: str):
+        def consume(sock, reader, status, headers):
+            body = bytearray()
+            for piece in iter_body(sock, reader, headers, status):
+                body += piece
+                if len(body) > MAX_LISTING_BYTES:
+                    raise ValueError("listing too large")
+            return {"body": bytes(body), "ctype": headers.get("content-type", "")}
+
+        r = pooled_get(self.pool, url, self.retries, consume)
+        if r["status"] != 200 or not r.get("ctype", "").startswith("text/html"):
+            self.count("failed")
+            self.report(r["status"] or "ERR", url, r["error"] or "not a listing")
+            return
+        self.count("dirs")
+        local = self.local_path(url)
+        if local is not None:
+            os.makedirs(local[1], exist_ok=True)
+        for link in listing_links(url, r["body"].decode("utf-8", "replace")):
+            self.enqueue(link)
+
+    def fetch_file(self, url: str):
+        local = self.local_path(url)
+        if local is None:
+            self.count("skipped")
+            return
+        rel, dest = local
+        with self.lock:
+            known = self.manifest.get(rel)
+        extra = {}
+        if known and os.path.isfile(dest) and os.path.getsize(dest) == known.get("size"):
+            if known.get("etag"):
+                extra["If-None-Match"] = known["etag"]
+            elif known.get("last_modified"):
+                extra["If-Modified-Since"] = known["last_modified"]
+
+        def consume(sock, reader, status, headers):
+            if status != 200:
+                for _ in iter_body(sock, reader, headers, status):
+                    pass
+                return {}
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            nbytes, _ = download(sock, reader, headers, dest)
+            meta = {"size": nbytes, "etag": headers.get("etag", ""),
+                    "last_modified": headers.get("last-modified", "")}
+            return {"bytes": nbytes, "meta": meta}
+
+        r = pooled_get(self.pool, url, self.retries, consume, extra)
+        if r["status"] == 304:
+            self.count("unchanged")
+            return
+        if r["status"] != 200:
+            self.count("failed")
+            self.report(r["status"] or "ERR", url, r["error"] or "")
+            return
+        with self.lock:
+            self.manifest[rel] = r["meta"]
+        self.count("saved")
+        self.count("bytes", r["bytes"])
+        self.report(200, url, f"{r['bytes']} B")
+
+    def worker(self):
+        while True:
+            item = self.todo.get()
+            if item is None:
+                return
+            kind, url = item
+            try:
+                if kind == "dir":
+                    self.crawl_dir(url)
+                else:
+                    self.fetch_file(url)
+            except OSError as e:   # local disk trouble; the crawl goes on
+                self.count("failed")
+                self.report("ERR", url, f"{type(e).__name__}: {e}")
+            finally:
+                self.todo.task_done()
+
+    def run(self):
+        os.makedirs(self.out_dir, exist_ok=True)
+        self.load_manifest()
+        start = time.perf_counter()
+        threads = [threading.Thread(target=self.worker, daemon=True) for _ in range(max(1, self.workers))]
+        for t in threads:
+            t.start()
+        self.enqueue(self.root)
+        try:
+            self.todo.join()   # FIFO queue, so directories are visited level by level
+        finally:
+            for _ in threads:
+                self.todo.put(None)
+            self.pool.close()
+            self.save_manifest()
+        return time.perf_counter() - start
+
+def mirror_main(argv) -> int:
+    ap = argparse.ArgumentParser(prog="client.py mirror",
+                                 description="Copy a directory tree from the server's listings, skipping unchanged files")
+    ap.add_argument("url", help="Directory URL to start from")
+    ap.add_argument("download_dir")
+    ap.add_argument("-c", "--concurrency", type=int, default=8, help="Worker threads (default 8)")
+    ap.add_argument("--per-host", type=int, default=4, help="Connections to the server (default 4)")
+    ap.add_argument("--retries", type=int, default=2)
+    ap.add_argument("--ext", action="append", help=f"File extension to fetch (default {' '.join(DEFAULT_EXTS)})")
+    args = ap.parse_args(argv)
+
+    job = Mirror(args.url, args.download_dir, args.concurrency, args.per_host, args.retries,
+                 args.ext or DEFAULT_EXTS)
+    try:
+        wall = job.run()
+    except KeyboardInterrupt:
+        print("Interrupted; files saved so far are recorded in the manifest", file=sys.stderr)
+        return 1
+    st = job.stats
+    print(f"-- {st['dirs']} directories | {st['saved']} saved, {st['unchanged']} unchanged, "
+          f"{st['failed']} failed, {st['skipped']} skipped | {st['bytes']} bytes in {wall:.3f}s "
+          f"({format_rate(st['bytes'], wall)}) | connections: {job.pool.opened} opened, {job.pool.reused} reuses")
+    return 1 if st["failed"] else 0
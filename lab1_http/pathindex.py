@@ -0,0 +1,272 @@
+# Path index for server.py and lab2's servers (PATH_INDEX). At startup every
+# file and directory below the served root is stat'ed once and kept under its
+# URL path, so a request for a known path is answered from a dict -- no
+# safe_join, no isdir/exists/stat -- and the stored stat result goes on to the
+# validators and the content caches. Only names found by walking the root are
+# keys, so "..", "." and doubled slashes never match and still go through
+# safe_join; so do symlinks and special files, which are left to the disk.
+#
+# On Linux an inotify watch per directory keeps the entries current (a queue
+# overflow means a full rescan). Elsewhere, or with PATH_INDEX=rescan, the tree
+# is rescanned every PATH_INDEX_RESCAN_SEC and answers can be that much behind.
+import errno
+import os
+import select
+import stat
+import struct
+import sys
+import threading
+
+try:
+    import ctypes
+    _libc = ctypes.CDLL(None, use_errno=True)
+    _libc.inotify_init1, _libc.inotify_add_watch   # AttributeError where there is no inotify
+except (ImportError, OSError, AttributeError, TypeError):
+    _libc = None
+
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE
+              | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR | IN_DONT_FOLLOW)
+EVENT = struct.Struct("iIII")   # wd, mask, cookie, len; then len bytes of NUL-padded name
+
+class IndexFull(Exception):
+    pass
+
+class PathIndex:
+    def __init__(self, root: str, content_type_for, max_entries: int = 1000000, rescan_sec: float = 2.0,
+                 on_give_up=None):
+        self.root = os.path.abspath(root)
+        self.content_type_for = content_type_for
+        self.max_entries = max_entries
+        self.rescan_sec = rescan_sec
+        self.entries = {}          # "a/b.html" -> (abs_path, stat_result, content type or None); "" is the root
+        self.passthrough = set()   # symlinks, special files, unreadable dirs: looked up on disk
+        self.watches = {}          # inotify wd -> directory key
+        self.fd = -1               # inotify instance, -1 = rescan mode
+        self.on_give_up = on_give_up   # called once the tree outgrows max_entries while serving
+        # Misses are counted per thread, like metrics.py, so 404s and new files
+        # never meet on a lock; the list of cells is locked only when it grows
+        self._local = threading.local()
+        self._miss_cells = []
+        self._cells_lock = threading.Lock()
+        self.rescans = 0
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    @property
+    def misses(self) -> int:
+        return sum(cell[0] for cell in list(self._miss_cells))
+
+    @property
+    def mode(self) -> str:
+        return "inotify" if self.fd >= 0 else f"rescan every {self.rescan_sec:g}s"
+
+    # ---- lookups (request path) ----
+
+    def get(self, url_path: str):
+        # Entry for a decoded URL path, or None when it has to be looked up on disk
+        entry = self.entries.get(url_path.strip("/"))
+        if entry is None:
+            cell = getattr(self._local, "misses", None)
+            if cell is None:
+                cell = self._local.misses = [0]
+                with self._cells_lock:
+                    self._miss_cells.append(cell)
+            cell[0] += 1
+        return entry
+
+    def stat(self, abs_path: str):
+        # Drop-in for os.stat(): a missing name in an indexed directory is
+        # known not to exist, anything outside the index goes to the disk
+        if abs_path.startswith(self.root + os.sep):
+            key = abs_path[len(self.root) + 1:].replace(os.sep, "/")
+            entry = self.entries.get(key)
+            if entry is not None:
+                return entry[1]
+            if key.rpartition("/")[0] in self.entries and key not in self.passthrough:
+                raise FileNotFoundError(errno.ENOENT, "Not in the path index", abs_path)
+        return os.stat(abs_path)
+
+    # ---- building ----
+
+    def start(self, watch: bool = True):
+        if watch and _libc is not None:
+            fd = _libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+            if fd < 0:
+                print(f"[path-index] inotify unavailable ({os.strerror(ctypes.get_errno())}); "
+                      f"rescanning instead", file=sys.stderr)
+            else:
+                self.fd = fd
+        try:
+            self.rebuild()
+        except BaseException:
+            self._close_inotify()
+            raise
+        self.thread = threading.Thread(target=self._run, name="path-index", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.thread is None:
+            return
+        self.stop_event.set()
+        self.thread.join(2.0)
+        self.thread = None
+        self._close_inotify()
+
+    def rebuild(self):
+        # Walks the whole tree into fresh tables and swaps them in
+        entries, passthrough = {}, set()
+        self.watches = {}
+        self._scan("", self.root, entries, passthrough)
+        self.entries, self.passthrough = entries, passthrough
+        self.rescans += 1
+
+    def _scan(self, key: str, abs_dir: str, entries: dict, passthrough: set):
+        # Adds abs_dir's subtree. Each directory is watched before it is listed,
+        # so a name created meanwhile is either listed or reported by an event.
+        stack = [(key, abs_dir)]
+        while stack:
+            key, abs_dir = stack.pop()
+            self._watch(key, abs_dir)
+            try:
+                st = os.stat(abs_dir)
+                with os.scandir(abs_dir) as it:
+                    children = list(it)
+            except (FileNotFoundError, NotADirectoryError):
+                continue   # gone again; the event for that is on its way
+            except OSError:
+                passthrough.add(key)
+                continue
+            entries[key] = (abs_dir, st, None)
+            for e in children:
+                child = f"{key}/{e.name}" if key else e.name
+                try:
+                    if e.is_dir(follow_symlinks=False):
+                        stack.append((child, e.path))
+                        continue
+                    st = e.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                if stat.S_ISREG(st.st_mode):
+                    entries[child] = (e.path, st, self.content_type_for(e.path))
+                else:
+                    passthrough.add(child)
+            if len(entries) > self.max_entries:
+                raise IndexFull(f"more than {self.max_entries} entries under {self.root}")
+
+    def _watch(self, key: str, abs_dir: str):
+        if self.fd < 0:
+            return
+        mask = WATCH_MASK if key else WATCH_MASK & ~IN_DONT_FOLLOW   # the root itself may be a symlink
+        wd = _libc.inotify_add_watch(self.fd, os.fsencode(abs_dir), mask)
+        if wd >= 0:
+            self.watches[wd] = key
+            return
+        err = ctypes.get_errno()
+        if err in (errno.ENOENT, errno.ENOTDIR):   # removed while we walked
+            return
+        # Usually ENOSPC, fs.inotify.max_user_watches used up: fall back to rescanning
+        print(f"[path-index] cannot watch {abs_dir}: {os.strerror(err)}; rescanning every "
+              f"{self.rescan_sec:g}s instead", file=sys.stderr)
+        self._close_inotify()
+
+    def _close_inotify(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+        self.watches = {}
+
+    # ---- keeping it current ----
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            try:
+                if self.fd >= 0:
+                    self._read_events(1.0)
+                elif not self.stop_event.wait(self.rescan_sec):
+                    self.rebuild()
+            except IndexFull as e:
+                print(f"[path-index] {e}; serving without the index", file=sys.stderr)
+                self.entries, self.passthrough = {}, set()
+                self._close_inotify()
+                if self.on_give_up is not None:
+                    self.on_give_up()
+                return
+            except OSError as e:
+                print(f"[path-index] update failed: {e!r}", file=sys.stderr)
+                self.stop_event.wait(1.0)
+
+    def _read_events(self, timeout: float):
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return
+        try:
+            data = os.read(self.fd, 256 * 1024)
+        except BlockingIOError:
+            return
+        dirty = set()
+        pos = 0
+        while pos + EVENT.size <= len(data):
+            wd, mask, _, size = EVENT.unpack_from(data, pos)
+            name = data[pos + EVENT.size:pos + EVENT.size + size].rstrip(b"\0")
+            pos += EVENT.size + size
+            if mask & IN_Q_OVERFLOW:
+                self.rebuild()   # events were lost; only a full walk is trustworthy
+                return
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            key = self.watches.get(wd)
+            if key is None:
+                continue
+            dirty.add(key)   # the directory's mtime changed, or the directory itself went away
+            if name:
+                name = os.fsdecode(name)
+                dirty.add(f"{key}/{name}" if key else name)
+        for key in sorted(dirty, key=len):
+            self.refresh(key)
+
+    def refresh(self, key: str):
+        # Brings one name in line with the disk; a new directory is scanned whole
+        abs_path = os.path.join(self.root, *key.split("/")) if key else self.root
+        try:
+            st = os.lstat(abs_path) if key else os.stat(abs_path)
+        except (FileNotFoundError, NotADirectoryError):
+            st = None
+        old = self.entries.get(key)
+        if st is None or not (stat.S_ISDIR(st.st_mode) or stat.S_ISREG(st.st_mode)):
+            self._forget(key)
+            if st is not None:
+                self.passthrough.add(key)
+            return
+        self.passthrough.discard(key)
+        if stat.S_ISDIR(st.st_mode):
+            if old is not None and old[2] is None:
+                self.entries[key] = (abs_path, st, None)   # known directory, new mtime
+            else:
+                self._forget(key)
+                self._scan(key, abs_path, self.entries, self.passthrough)
+            return
+        if old is not None and old[2] is None:
+            self._forget(key)   # a directory replaced by a file
+        self.entries[key] = (abs_path, st, self.content_type_for(abs_path))
+
+    def _forget(self, key: str):
+        # Drops key and, if it was a directory, everything below it
+        self.entries.pop(key, None)
+        self.passthrough.discard(key)
+        prefix = key + "/"
+        for k in [k for k in self.entries if k.startswith(prefix)]:
+            del self.entries[k]
+        self.passthrough -= {k for k in self.passthrough if k.startswith(prefix)}
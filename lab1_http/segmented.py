@@ -0,0 +1,285 @@
+# Segmented downloads for client.py ("python client.py segmented URL DIR").
+# A probe request (Range: bytes=0-0) learns the size and validator; the output
+# file is preallocated and N threads each fetch one byte range and write it in
+# place with os.pwrite, so there is no reassembly step. Progress goes to a
+# sidecar "<file>.part.json" (after an fsync of the data it describes), and a
+# rerun with the same URL picks up every segment where it stopped. If-Range
+# makes the server send the whole file instead of a range if it changed in
+# between, and that aborts the download rather than mixing two versions.
+# Servers without range support get a single plain stream.
+import argparse
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+from httpparse import HeadReader
+from client import split_url, send_get, iter_body, download, format_rate, IncompleteBody, CHUNK_SIZE
+
+STATE_VERSION = 1
+MIN_SEGMENT = 256 * 1024       # smaller files are not worth splitting
+SAVE_EVERY_SEC = 1.0           # how often progress is flushed to the sidecar
+
+class FileChanged(Exception):
+    pass
+
+def parse_content_range(value: str):
+    # "bytes 0-99/1234" -> (0, 99, 1234); size is None for "*"
+    unit, _, spec = value.strip().partition(" ")
+    if unit.lower() != "bytes":
+        return None
+    span, _, size = spec.partition("/")
+    first, _, last = span.partition("-")
+    try:
+        return int(first), int(last), None if size == "*" else int(size)
+    except ValueError:
+        return None
+
+def unsatisfied_size(value: str):
+    # "bytes */1234" from a 416 -> 1234, else None
+    unit, _, spec = value.strip().partition(" ")
+    if unit.lower() != "bytes" or not spec.startswith("*/"):
+        return None
+    try:
+        return int(spec[2:])
+    except ValueError:
+        return None
+
+def validator(headers: dict) -> str:
+    # Strong ETag if there is one, else Last-Modified; either works as If-Range
+    etag = headers.get("etag", "")
+    if etag and not etag.startswith("W/"):
+        return etag
+    return headers.get("last-modified", "")
+
+def plan_segments(size: int, parts: int):
+    parts = max(1, min(parts, size // MIN_SEGMENT or 1))
+    step = -(-size // parts)
+    return [[start, min(start + step, size) - 1, 0] for start in range(0, size, step)]   # [first, last, done]
+
+class SegmentedDownload:
+    def __init__(self, url: str, dest: str, parts: int = 4, retries: int = 3, timeout: float = 10.0):
+        self.url = url
+        self.dest = dest
+        self.tmp = dest + ".part"
+        self.state_path = dest + ".part.json"
+        self.parts = parts
+        self.retries = retries
+        self.timeout = timeout
+        self.host, self.port, self.path = split_url(url)
+        self.size = 0
+        self.validator = ""
+        self.segments = []
+        self.fd = -1
+        self.lock = threading.Lock()   # segments' done counters vs. the state writer
+        self.write_lock = threading.Lock()   # only for the lseek+write fallback
+        self.errors = []
+
+    # ---- probe and state ----
+
+    def connect(self):
+        s = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        return s, HeadReader()
+
+    def load_state(self) -> bool:
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                st = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if (st.get("version") != STATE_VERSION or st.get("url") != self.url or st.get("size") != self.size
+                or st.get("validator") != self.validator):
+            return False
+        try:
+            if os.path.getsize(self.tmp) != self.size:
+                return False
+        except OSError:
+            return False
+        self.segments = [list(seg) for seg in st["segments"]]
+        return True
+
+    def save_state(self):
+        # Counters are bumped after their bytes are written, so everything a
+        # snapshot counts is on disk once the fsync after it returns
+        with self.lock:
+            segments = [list(seg) for seg in self.segments]
+        os.fsync(self.fd)
+        doc = {"version": STATE_VERSION, "url": self.url, "size": self.size,
+               "validator": self.validator, "segments": segments}
+        tmp = self.state_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(doc, f)
+        os.replace(tmp, self.state_path)
+
+    def pwrite(self, data, offset: int):
+        if hasattr(os, "pwrite"):
+            while data:
+                n = os.pwrite(self.fd, data, offset)
+                data, offset = data[n:], offset + n
+        else:
+            with self.write_lock:
+                os.lseek(self.fd, offset, os.SEEK_SET)
+                while data:
+                    data = data[os.write(self.fd, data):]
+
+    # ---- fetching ----
+
+    def fetch_segment(self, seg):
+        # Fetches seg[first + done .. last] on its own connection; reconnects on
+        # transient errors and continues from what was already written
+        failures = 0
+        while True:
+            with self.lock:
+                first, last, done = seg
+            if first + done > last:
+                return
+            try:
+                s, reader = self.connect()
+                with s:
+                    extra = {"Range": f"bytes={first + done}-{last}"}
+                    if self.validator:
+                        extra["If-Range"] = self.validator
+                    _, status, headers = send_get(s, reader, self.host, self.path, extra=extra)
+                    if status == 200:
+                        raise FileChanged(f"{self.url} changed on the server; delete {self.state_path} to restart")
+                    if status != 206:
+                        raise ConnectionError(f"unexpected status {status} for a range request")
+                    cr = parse_content_range(headers.get("content-range", ""))
+                    if cr is None or cr[0] != first + done or cr[1] != last:
+                        raise ConnectionError(f"server sent range {headers.get('content-range')!r}")
+                    self.read_into_file(s, reader, seg, first + done, last - (first + done) + 1)
+                return
+            except FileChanged:
+                raise
+            except (OSError, ValueError) as e:
+                failures += 1
+                if failures > self.retries:
+                    raise
+                print(f"[segment {first}-{last}] {type(e).__name__}: {e}; retry {failures}/{self.retries}",
+                      file=sys.stderr)
+                time.sleep(min(0.2 * 2 ** failures, 5.0))
+
+    def read_into_file(self, s, reader: HeadReader, seg, offset: int, count: int):
+        # recv_into one reusable buffer and pwrite from it: no per-chunk allocation
+        buf = bytearray(CHUNK_SIZE)
+        view = memoryview(buf)
+        if len(reader):
+            data = reader.take(count)
+            self.pwrite(data, offset)
+            offset += len(data)
+            count -= len(data)
+            with self.lock:
+                seg[2] += len(data)
+        while count > 0:
+            n = s.recv_into(view, min(CHUNK_SIZE, count))
+            if n == 0:
+                raise IncompleteBody(seg[2], seg[1] - seg[0] + 1)
+            self.pwrite(view[:n], offset)
+            offset += n
+            count -= n
+            with self.lock:
+                seg[2] += n
+
+    def run(self):
+        # Returns (bytes fetched in this run, seconds, segments used)
+        start = time.perf_counter()
+        s, reader = self.connect()
+        with s:
+            _, status, headers = send_get(s, reader, self.host, self.path, extra={"Range": "bytes=0-0"})
+            if status == 416 and unsatisfied_size(headers.get("content-range", "")) == 0:
+                # Even byte 0 is out of range: the file is empty
+                for _ in iter_body(s, reader, headers, status):
+                    pass
+                self.save_empty()
+                return 0, time.perf_counter() - start, 1
+            cr = parse_content_range(headers.get("content-range", "")) if status == 206 else None
+            if cr is None or cr[2] is None:
+                if status != 200:
+                    raise ConnectionError(f"probe answered {status}")
+                # No usable range support: the probe response is the whole file
+                print("Server does not support ranges; downloading in one stream")
+                nbytes, _ = download(s, reader, headers, self.dest)
+                return nbytes, time.perf_counter() - start, 1
+            for _ in iter_body(s, reader, headers):   # the one probed byte
+                pass
+        self.size = cr[2]
+        self.validator = validator(headers)
+
+        resumed = self.load_state()
+        if not resumed:
+            self.segments = plan_segments(self.size, self.parts)
+        flags = os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0)
+        self.fd = os.open(self.tmp, flags, 0o644)
+        try:
+            if not resumed:
+                os.ftruncate(self.fd, self.size)   # sparse until written; positional writes fill it in
+                self.save_state()
+            already = sum(seg[2] for seg in self.segments)
+            if resumed:
+                print(f"Resuming: {already} of {self.size} bytes already on disk")
+            self.fetch_all()
+            os.fsync(self.fd)
+        finally:
+            os.close(self.fd)
+            self.fd = -1
+        os.replace(self.tmp, self.dest)
+        os.remove(self.state_path)
+        return self.size - already, time.perf_counter() - start, len(self.segments)
+
+    def save_empty(self):
+        # dest becomes an empty file; progress left by an earlier run is dropped
+        with open(self.tmp, "wb"):
+            pass
+        os.replace(self.tmp, self.dest)
+        for path in (self.state_path, self.state_path + ".tmp"):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def fetch_all(self):
+        def worker(seg):
+            try:
+                self.fetch_segment(seg)
+            except BaseException as e:
+                self.errors.append(e)
+
+        threads = [threading.Thread(target=worker, args=(seg,), daemon=True) for seg in self.segments]
+        for t in threads:
+            t.start()
+        try:
+            while any(t.is_alive() for t in threads):
+                for t in threads:
+                    t.join(SAVE_EVERY_SEC / len(threads))
+                self.save_state()
+        finally:
+            self.save_state()   # whatever happened, the next run starts from here
+        if self.errors:
+            raise self.errors[0]
+
+def segmented_main(argv) -> int:
+    ap = argparse.ArgumentParser(prog="client.py segmented",
+                                 description="Download one file over several parallel byte ranges, with resume")
+    ap.add_argument("url")
+    ap.add_argument("download_dir")
+    ap.add_argument("-n", "--segments", type=int, default=4, help="Parallel ranges (default 4)")
+    ap.add_argument("--retries", type=int, default=3, help="Reconnects per segment (default 3)")
+    ap.add_argument("--timeout", type=float, default=10.0)
+    args = ap.parse_args(argv)
+
+    os.makedirs(args.download_dir, exist_ok=True)
+    base = os.path.basename(split_url(args.url)[2].split("?", 1)[0]) or "download"
+    dest = os.path.join(args.download_dir, base)
+    job = SegmentedDownload(args.url, dest, args.segments, args.retries, args.timeout)
+    try:
+        nbytes, seconds, parts = job.run()
+    except (OSError, ValueError, FileChanged, KeyboardInterrupt) as e:
+        print(f"Download failed: {e!r}" if not isinstance(e, KeyboardInterrupt) else "Interrupted", file=sys.stderr)
+        if os.path.exists(job.state_path):
+            print(f"Progress kept in {job.state_path}; run the same command again to resume", file=sys.stderr)
+        return 1
+    print(f"Saved: {dest} ({nbytes} bytes in {seconds:.3f}s over {parts} "
+          f"{'segment' if parts == 1 else 'segments'}, {format_rate(nbytes, seconds)})")
+    return 0
@@ -1,36 +1,364 @@
 #!/usr/bin/env python3
 import os
 import sys
+import stat
 import socket
 import mimetypes
 import urllib.parse
-from datetime import datetime
+from functools import lru_cache
+from email.utils import formatdate, parsedate_to_datetime
 from html import escape
 import time
+import uuid
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from fscache import FileCache, DirCache
+from compress import compressible, negotiate, compress_bytes, compress_chunks
+from httpparse import HeadReader, HeadError, parse_request_head, content_length, is_digits, MAX_HEADER_BYTES, MAX_LENGTH_DIGITS
+from metrics import Metrics, response_status, response_size, cache_ratio
+from accesslog import AccessLog
+from pathindex import PathIndex, IndexFull
 
 DELAY_MS = int(os.environ.get("DELAY_MS", "0"))
 HOST = os.environ.get("HOST", "0.0.0.0")
 PORT = int(os.environ.get("PORT", "8080"))
+KEEPALIVE_TIMEOUT = float(os.environ.get("KEEPALIVE_TIMEOUT", "2.0"))        # idle seconds between requests
+MAX_KEEPALIVE_REQUESTS = int(os.environ.get("MAX_KEEPALIVE_REQUESTS", "100"))  # requests per connection
+CHUNK_SIZE = 64 * 1024   # read size when os.sendfile is not available
+FILE_CACHE_BYTES = int(os.environ.get("FILE_CACHE_BYTES", str(16 * 1024 * 1024)))   # 0 = no content cache
+FILE_CACHE_MAX_FILE = int(os.environ.get("FILE_CACHE_MAX_FILE", str(1024 * 1024)))  # bigger files are streamed
+COMPRESS = int(os.environ.get("COMPRESS", "1")) == 1                    # Accept-Encoding negotiation
+COMPRESS_LEVEL = int(os.environ.get("COMPRESS_LEVEL", "6"))
+COMPRESS_MIN_SIZE = int(os.environ.get("COMPRESS_MIN_SIZE", "256"))     # smaller bodies go out as-is
+COMPRESS_MAX_FILE = int(os.environ.get("COMPRESS_MAX_FILE", str(4 * 1024 * 1024)))  # on-the-fly limit
+COMPRESS_CACHE_BYTES = int(os.environ.get("COMPRESS_CACHE_BYTES", str(8 * 1024 * 1024)))
+METRICS_PATH = os.environ.get("METRICS_PATH", "/metrics")   # "" = no metrics; JSON at METRICS_PATH + ".json"
+ACCESS_LOG = os.environ.get("ACCESS_LOG", "")                # file for JSON-lines access records, "" = off
+ACCESS_LOG_MAX_BYTES = int(os.environ.get("ACCESS_LOG_MAX_BYTES", str(10 * 1024 * 1024)))  # rotate past this, 0 = never
+ACCESS_LOG_BACKUPS = int(os.environ.get("ACCESS_LOG_BACKUPS", "5"))
+ACCESS_LOG_QUEUE = int(os.environ.get("ACCESS_LOG_QUEUE", "65536"))   # pending records; more are dropped
+ACCESS_LOG_FLUSH_SEC = float(os.environ.get("ACCESS_LOG_FLUSH_SEC", "0.5"))
+PATH_INDEX = os.environ.get("PATH_INDEX", "auto")   # "auto" = inotify where available, "rescan", "off"
+PATH_INDEX_RESCAN_SEC = float(os.environ.get("PATH_INDEX_RESCAN_SEC", "2.0"))   # without inotify
+PATH_INDEX_MAX_ENTRIES = int(os.environ.get("PATH_INDEX_MAX_ENTRIES", "1000000"))  # bigger trees go unindexed
 
 ALLOWED_EXTS = {".html", ".png", ".pdf"}
+MAX_RANGES = 16   # more ranges than this in one request and the whole file is sent instead
+BOUNDARY = uuid.uuid4().hex
+CACHE_CONTROL = {
+    ".html": "no-cache",                 # always revalidate, usually answered with a 304
+    ".png": "public, max-age=86400",
+    ".pdf": "public, max-age=86400",
+}
+
+FILE_CACHE = FileCache(FILE_CACHE_BYTES, FILE_CACHE_MAX_FILE)
+COMPRESSED_CACHE = FileCache(COMPRESS_CACHE_BYTES, COMPRESS_MAX_FILE)   # (abs_path, coding) -> bytes
+METRICS = Metrics()
+ACCESS = None   # AccessLog once open_access_log() ran
+INDEX = None    # PathIndex once open_path_index() ran
+
+SERVER_NAME = "PR-Lab1-PythonSocket/1.1"
+HEADER_LINE_CACHE = 4096   # encoded "Name: value" lines kept for reuse
+
+_DATE_LINE = (0, b"")      # (unix second, b"Date: ...\r\n"), swapped atomically
+_STATUS_LINES = {}         # (status, reason) -> status line + Server line
+_HEADER_LINES = {}         # (name, value) -> encoded header line
+
+@lru_cache(maxsize=4096)
+def http_date(ts: int) -> str:
+    # Last-Modified values repeat per file, so each second is formatted once
+    return formatdate(ts, usegmt=True)
+
+def date_line() -> bytes:
+    # RFC 7231 IMF-fixdate in UTC, formatted at most once a second
+    global _DATE_LINE
+    now = int(time.time())
+    sec, line = _DATE_LINE
+    if sec != now:
+        line = f"Date: {formatdate(now, usegmt=True)}\r\n".encode("ascii")
+        _DATE_LINE = (now, line)
+    return line
+
+def status_line(status_code: int, reason: str) -> bytes:
+    line = _STATUS_LINES.get((status_code, reason))
+    if line is None:
+        line = f"HTTP/1.1 {status_code} {reason}\r\nServer: {SERVER_NAME}\r\n".encode("ascii")
+        _STATUS_LINES[(status_code, reason)] = line
+    return line
 
-def http_date(dt: datetime) -> str:
-    return dt.strftime("%a, %d %b %Y %H:%M:%S GMT")
+def header_line(name: str, value) -> bytes:
+    # Content types, Connection/Keep-Alive, Cache-Control and the like repeat on
+    # every response, so their encoded lines are looked up instead of rebuilt
+    key = (name, value)
+    line = _HEADER_LINES.get(key)
+    if line is None:
+        line = f"{name}: {value}\r\n".encode("utf-8", "replace")
+        if len(_HEADER_LINES) >= HEADER_LINE_CACHE:
+            _HEADER_LINES.clear()
+        _HEADER_LINES[key] = line
+    return line
+
+def build_head(status_code: int, reason: str, headers: dict, content_length) -> bytes:
+    # content_length=None leaves the header out (304 responses). Only the head is
+    # returned; bodies travel separately (FileResponse parts / send_buffers).
+    headers = headers or {}
+    lines = [status_line(status_code, reason), date_line()]
+    if content_length is not None:
+        lines.append(b"Content-Length: %d\r\n" % content_length)
+    if "Connection" not in headers:
+        lines.append(b"Connection: close\r\n")
+    for k, v in headers.items():
+        lines.append(header_line(k, v))
+    lines.append(b"\r\n")
+    return b"".join(lines)
 
 def build_response(status_code: int, reason: str, headers: dict, body: bytes) -> bytes:
-    lines = [f"HTTP/1.1 {status_code} {reason}"]
-    base_headers = {
-        "Server": "PR-Lab1-PythonSocket/1.1",
-        "Date": http_date(datetime.now()),
-        "Content-Length": str(len(body)),
-        "Connection": "close",
+    # One buffer for small fixed responses (errors, 429); large bodies should go
+    # out as FileResponse(build_head(...), None, [body]) to skip this copy
+    return build_head(status_code, reason, headers, len(body)) + body
+
+class FileResponse:
+    # Header bytes plus slices of an open file (streamed, never read whole)
+    # or, with f=None, cached body bytes sent after the head without concatenation
+    def __init__(self, head: bytes, f, parts):
+        self.head = head
+        self.f = f
+        self.parts = parts  # list of bytes or (offset, count)
+
+def send_file(conn, f, offset: int, count: int):
+    if hasattr(os, "sendfile"):
+        conn.sendfile(f, offset, count)
+        return
+    f.seek(offset)
+    while count > 0:
+        chunk = f.read(min(CHUNK_SIZE, count))
+        if not chunk:
+            break
+        conn.sendall(chunk)
+        count -= len(chunk)
+
+IOV_MAX = 64   # buffers per sendmsg call, well under the kernel limit
+
+def send_buffers(conn, buffers, more: bool = False):
+    # Scatter write (writev): head and body buffers leave in as few sendmsg
+    # calls as the kernel allows, without joining them into one bytes object.
+    # more=True sets MSG_MORE so a following sendfile shares the first segment.
+    if not hasattr(conn, "sendmsg"):
+        for buf in buffers:
+            conn.sendall(buf)
+        return
+    flags = getattr(socket, "MSG_MORE", 0) if more else 0
+    views = [memoryview(b) for b in buffers if len(b)]
+    i = 0
+    while i < len(views):
+        sent = conn.sendmsg(views[i:i + IOV_MAX], [], flags)
+        while sent and i < len(views):
+            n = len(views[i])
+            if sent >= n:
+                sent -= n
+                i += 1
+            else:
+                views[i] = views[i][sent:]
+                sent = 0
+
+def send_response(conn, resp):
+    if isinstance(resp, bytes):
+        conn.sendall(resp)
+        return
+    try:
+        pending = [resp.head]
+        for part in resp.parts:
+            if isinstance(part, tuple):
+                send_buffers(conn, pending, more=True)
+                pending = []
+                send_file(conn, resp.f, *part)
+            else:
+                pending.append(part)
+        send_buffers(conn, pending)
+    finally:
+        if resp.f is not None:
+            resp.f.close()
+
+def etag_for(st, encoding: str = None) -> str:
+    # Each content-coding is its own representation and needs its own tag
+    suffix = f"-{encoding}" if encoding else ""
+    return f'"{st.st_ino:x}-{st.st_mtime_ns:x}-{st.st_size:x}{suffix}"'
+
+def validator_headers(abs_path: str, st, encoding: str = None) -> dict:
+    headers = {
+        "ETag": etag_for(st, encoding),
+        "Last-Modified": http_date(int(st.st_mtime)),
     }
-    base_headers.update(headers or {})
-    for k, v in base_headers.items():
-        lines.append(f"{k}: {v}")
-    lines.append("")
-    head = ("\r\n".join(lines) + "\r\n").encode("utf-8", "replace")
-    return head + body
+    cache_control = CACHE_CONTROL.get(os.path.splitext(abs_path)[1].lower())
+    if cache_control:
+        headers["Cache-Control"] = cache_control
+    return headers
+
+def not_modified(req_headers: dict, etag: str, mtime: float) -> bool:
+    inm = req_headers.get("if-none-match")
+    if inm is not None:
+        # If-None-Match wins over If-Modified-Since; weak comparison as for GET
+        tags = {t.strip().removeprefix("W/") for t in inm.split(",")}
+        return "*" in tags or etag in tags
+    ims = req_headers.get("if-modified-since")
+    if ims:
+        try:
+            return int(mtime) <= parsedate_to_datetime(ims).timestamp()
+        except (TypeError, ValueError, OverflowError, IndexError):
+            return False   # an unreadable date counts as modified: send the full response
+    return False
+
+def range_pos(text: str):
+    # A byte position from a Range header, or None; more than MAX_LENGTH_DIGITS
+    # digits is past any file and past what int() will convert
+    if len(text) > MAX_LENGTH_DIGITS or not is_digits(text):
+        return None
+    return int(text)
+
+def parse_ranges(value: str, size: int):
+    # "bytes=0-99,200-,-50" -> [(start, end_inclusive), ...]; [] when nothing is
+    # satisfiable, None when the header is malformed (then it is ignored)
+    unit, _, spec = value.partition("=")
+    if unit.strip().lower() != "bytes" or not spec.strip():
+        return None
+    ranges = []
+    for part in spec.split(","):
+        first, dash, last = part.strip().partition("-")
+        if not dash:
+            return None
+        if not first:
+            n = range_pos(last)
+            if n is None:
+                return None
+            if n > 0 and size > 0:
+                ranges.append((max(0, size - n), size - 1))
+            continue
+        start = range_pos(first)
+        end = range_pos(last) if last else size - 1
+        if start is None or end is None or (last and end < start):
+            return None
+        if start < size:
+            ranges.append((start, min(end, size - 1)))
+    if len(ranges) > MAX_RANGES:
+        return None
+    return ranges
+
+def if_range_matches(req_headers: dict, headers: dict) -> bool:
+    cond = req_headers.get("if-range")
+    if not cond:
+        return True
+    cond = cond.strip()
+    if cond.startswith('"'):
+        return cond == headers["ETag"]     # strong comparison only
+    if cond.startswith("W/"):
+        return False
+    return cond == headers["Last-Modified"]
+
+def accepted_encoding(ctype: str, req_headers: dict, size: int):
+    # Content-coding to use for a body of this type and size, plus the Vary header it needs
+    if not COMPRESS or not compressible(ctype):
+        return None, {}
+    vary = {"Vary": "Accept-Encoding"}
+    if not req_headers or size < COMPRESS_MIN_SIZE:
+        return None, vary
+    return negotiate(req_headers.get("accept-encoding", "")), vary
+
+def precompressed_sibling(abs_path: str, st):
+    # foo.html.gz next to foo.html, if it is at least as new as the original
+    try:
+        gz_st = (INDEX.stat if INDEX is not None else os.stat)(abs_path + ".gz")
+    except OSError:
+        return None
+    return abs_path + ".gz" if gz_st.st_mtime_ns >= st.st_mtime_ns else None
+
+def compressed_variant(abs_path: str, st, encoding: str) -> bytes:
+    key = (st.st_mtime_ns, st.st_size)
+    data = COMPRESSED_CACHE.get((abs_path, encoding), key)
+    if data is None:
+        source, _ = FILE_CACHE.lookup(abs_path, st)
+        if source is None:
+            with open(abs_path, "rb") as f:
+                source = f.read()
+        data = compress_bytes(source, encoding, COMPRESS_LEVEL)
+        COMPRESSED_CACHE.put((abs_path, encoding), key, data)
+    return data
+
+def file_response(abs_path: str, headers: dict, req_headers: dict = None, st=None):
+    # Returns a FileResponse for the whole file or the requested byte ranges,
+    # or a bodiless 304 when the client's validators still match.
+    # Raises OSError if the file cannot be read.
+    if st is None:
+        st = os.stat(abs_path)
+    encoding, vary = accepted_encoding(headers.get("Content-Type", ""), req_headers, st.st_size)
+    sibling = precompressed_sibling(abs_path, st) if encoding == "gzip" else None
+    if encoding and sibling is None and st.st_size > COMPRESS_MAX_FILE:
+        encoding = None
+
+    headers = {**headers, **vary, **validator_headers(abs_path, st, encoding), "Accept-Ranges": "bytes"}
+    if req_headers and not_modified(req_headers, headers["ETag"], st.st_mtime):
+        del headers["Content-Type"]
+        return build_head(304, "Not Modified", headers, None)
+
+    if encoding:
+        # Encoded bodies are always sent whole; Range applies to identity only
+        headers["Content-Encoding"] = encoding
+        if sibling is not None:
+            f = open(sibling, "rb")
+            size = os.fstat(f.fileno()).st_size
+            return FileResponse(build_head(200, "OK", headers, size), f, [(0, size)])
+        data = compressed_variant(abs_path, st, encoding)
+        return FileResponse(build_head(200, "OK", headers, len(data)), None, [data])
+
+    f = None
+    data, _ = FILE_CACHE.lookup(abs_path, st)
+    if data is not None:
+        size = len(data)
+        view = memoryview(data)
+        chunk = lambda start, count: view[start:start + count]
+    else:
+        f = open(abs_path, "rb")
+        try:
+            size = os.fstat(f.fileno()).st_size
+        except OSError:
+            f.close()
+            raise
+        chunk = lambda start, count: (start, count)
+
+    ranges = None
+    if req_headers and "range" in req_headers and if_range_matches(req_headers, headers):
+        ranges = parse_ranges(req_headers["range"], size)
+
+    if ranges is None:
+        return FileResponse(build_head(200, "OK", headers, size), f, [chunk(0, size)])
+
+    if not ranges:
+        if f is not None:
+            f.close()
+        return build_response(416, "Range Not Satisfiable",
+                              {**headers, "Content-Range": f"bytes */{size}"}, b"")
+
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        head = build_head(206, "Partial Content", headers, end - start + 1)
+        return FileResponse(head, f, [chunk(start, end - start + 1)])
+
+    # multipart/byteranges: part headers interleaved with slices of the file
+    ctype = headers.pop("Content-Type")
+    headers["Content-Type"] = f"multipart/byteranges; boundary={BOUNDARY}"
+    parts = []
+    length = 0
+    for i, (start, end) in enumerate(ranges):
+        part_head = (("" if i == 0 else "\r\n") + f"--{BOUNDARY}\r\n"
+                     f"Content-Type: {ctype}\r\n"
+                     f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n").encode("latin-1")
+        parts.append(part_head)
+        parts.append(chunk(start, end - start + 1))
+        length += len(part_head) + end - start + 1
+    tail = f"\r\n--{BOUNDARY}--\r\n".encode("latin-1")
+    parts.append(tail)
+    length += len(tail)
+    return FileResponse(build_head(206, "Partial Content", headers, length), f, parts)
 
 def safe_join(base: str, path: str) -> str:
     full = os.path.normpath(os.path.join(base, path.lstrip("/")))
@@ -40,37 +368,32 @@ def safe_join(base: str, path: str) -> str:
         raise PermissionError("Path traversal attempt")
     return full
 
+def resolve_path(base_dir: str, path: str):
+    # (abs_path, st, content type) for a decoded URL path: from the path index
+    # if it knows the path, else via safe_join and one os.stat. st is None when
+    # nothing is there; the content type is None for directories.
+    # Raises PermissionError for paths outside base_dir.
+    if INDEX is not None:
+        entry = INDEX.get(path)
+        if entry is not None:
+            return entry
+    abs_path = safe_join(base_dir, "." + path)
+    try:
+        st = os.stat(abs_path)
+    except (OSError, ValueError):
+        return abs_path, None, None
+    return abs_path, st, None if stat.S_ISDIR(st.st_mode) else content_type_for(abs_path)
+
 def rel_href(name: str, is_dir: bool) -> str:
     from urllib.parse import quote
     return quote(name) + ("/" if is_dir else "")
 
-def list_directory(absdir: str, url_path: str) -> bytes:
-    items_html = []
-    if url_path not in ("/", ""):
-        parent = url_path.rstrip("/")
-        cut = parent.rfind("/")
-        parent = "/" if cut <= 0 else parent[:cut] + "/"
-        items_html.append(
-            f'<li class="up"><a href="{escape(parent)}">⬆ Parent directory</a></li>'
-        )
-
-    for name in sorted(os.listdir(absdir), key=str.lower):
-        if name == ".DS_Store" or name == "404.html":
-            continue
-        p = os.path.join(absdir, name)
-        is_dir = os.path.isdir(p)
-        disp = name + ("/" if is_dir else "")
-        href = rel_href(name, is_dir)
-        items_html.append(
-            f'<li><a href="{href}">{escape(disp)}</a></li>'
-        )
-
-    page = f"""<!doctype html>
+LISTING_HEAD = """<!doctype html>
 <html>
   <head>
     <meta charset="utf-8"/>
     <meta name="viewport" content="width=device-width,initial-scale=1"/>
-    <title>Index of {escape(url_path)}</title>
+    <title>Index of {title}</title>
     <style>
       :root {{
         --bg: #0b1020;
@@ -150,19 +473,57 @@ def list_directory(absdir: str, url_path: str) -> bytes:
   <body>
     <div class="wrap">
       <header>
-        <h1>Index of <code>{escape(url_path if url_path else "/")}</code></h1>
+        <h1>Index of <code>{heading}</code></h1>
         <div class="legend">Click to open files or browse subdirectories.</div>
       </header>
       <section class="card">
         <ul>
-          {"".join(items_html) if items_html else '<li><em>(empty)</em></li>'}
+          """
+LISTING_TAIL = """
         </ul>
       </section>
       <footer>PR Lab 1 – HTTP file server with TCP sockets. Made by Aliosa Pavlovschii. FAF-231</footer>
     </div>
   </body>
 </html>"""
-    return page.encode("utf-8")
+
+DIR_CACHE = DirCache()
+
+def list_directory(absdir: str, url_path: str, encoding: str = None, mtime: int = None) -> bytes:
+    # Only the rows depend on the directory; the page around them is a fixed template.
+    # Each content-coding of the page is cached next to the plain one.
+    # The compressed variant is built by feeding the rows to the compressor one
+    # at a time, so only compressed output is held, never the plain page.
+    if encoding:
+        return DIR_CACHE.get(absdir, (url_path, encoding), lambda entries: b"".join(compress_chunks(
+            directory_parts(entries, url_path), encoding, COMPRESS_LEVEL)), mtime)
+    return DIR_CACHE.get(absdir, url_path, lambda entries: render_directory(entries, url_path), mtime)
+
+def render_directory(entries, url_path: str) -> bytes:
+    return "".join(directory_parts(entries, url_path)).encode("utf-8")
+
+def directory_parts(entries, url_path: str):
+    # Yields the listing page piece by piece: template head, one <li> per entry, tail
+    yield LISTING_HEAD.format(title=escape(url_path), heading=escape(url_path if url_path else "/"))
+    empty = True
+    if url_path not in ("/", ""):
+        parent = url_path.rstrip("/")
+        cut = parent.rfind("/")
+        parent = "/" if cut <= 0 else parent[:cut] + "/"
+        empty = False
+        yield f'<li class="up"><a href="{escape(parent)}">⬆ Parent directory</a></li>'
+
+    for name, is_dir in entries:
+        if name == ".DS_Store" or name == "404.html":
+            continue
+        disp = name + ("/" if is_dir else "")
+        href = rel_href(name, is_dir)
+        empty = False
+        yield f'<li><a href="{href}">{escape(disp)}</a></li>'
+
+    if empty:
+        yield '<li><em>(empty)</em></li>'
+    yield LISTING_TAIL
 
 def allowed_file(path: str) -> bool:
     return os.path.splitext(path)[1].lower() in ALLOWED_EXTS
@@ -177,89 +538,213 @@ def content_type_for(path: str) -> str:
         return "application/pdf"
     return mimetypes.guess_type(path)[0] or "application/octet-stream"
 
-def handle_request(conn, base_dir: str):
-    data = b""
-    conn.settimeout(2.0)
+def wants_keep_alive(version: str, headers: dict) -> bool:
+    tokens = {t.strip().lower() for t in headers.get("connection", "").split(",")}
+    if version == "HTTP/1.1":
+        return "close" not in tokens
+    return "keep-alive" in tokens
+
+def connection_headers(keep_alive: bool) -> dict:
+    if not keep_alive:
+        return {"Connection": "close"}
+    return {
+        "Connection": "keep-alive",
+        "Keep-Alive": f"timeout={int(KEEPALIVE_TIMEOUT)}, max={MAX_KEEPALIVE_REQUESTS}",
+    }
+
+def read_request(conn, reader: HeadReader, timeout: float):
+    # One request head from `reader`; pipelined requests that arrived in the
+    # same recv stay buffered for the next call. Raises HeadError.
+    conn.settimeout(timeout)
+    return reader.read_head(conn)
+
+def discard_body(conn, reader: HeadReader, headers: dict):
+    remaining = content_length(headers) or 0
+    remaining -= len(reader.take(remaining))
+    while remaining > 0:
+        chunk = conn.recv(min(remaining, 65536))
+        if not chunk:
+            return
+        remaining -= len(chunk)
+
+def send_and_close(conn, resp: bytes, linger: float = 0.0):
+    # FIN after the response, then discard request bytes still coming in:
+    # closing with unread data would make the kernel send a RST and the client
+    # could lose the response. linger=0 only drains what is already buffered.
     try:
-        while b"\r\n\r\n" not in data and len(data) < 65536:
-            chunk = conn.recv(4096)
+        conn.sendall(resp)
+        conn.shutdown(socket.SHUT_WR)
+        if linger > 0:
+            conn.settimeout(linger)
+        else:
+            conn.setblocking(False)
+        drained = 0
+        while drained < 4 * MAX_HEADER_BYTES:
+            chunk = conn.recv(65536)
             if not chunk:
                 break
-            data += chunk
-    except socket.timeout:
-        return
+            drained += len(chunk)
+    except OSError:
+        pass
+
+def bad_request(err: HeadError = None) -> bytes:
+    status, reason = (err.status, err.reason) if err else (400, "Bad Request")
+    return build_response(status, reason,
+                          {"Content-Type": "text/plain; charset=utf-8", "Connection": "close"},
+                          reason.encode("ascii"))
 
-    if not data:
+def register_cache_metrics(listing_cache):
+    caches = {"file": FILE_CACHE, "compressed": COMPRESSED_CACHE, "listing": listing_cache}
+    METRICS.add_source("cache_hits_total", "counter", "Cache lookups answered from memory, by cache.",
+                       lambda: {name: c.hits for name, c in caches.items()}, label="cache")
+    METRICS.add_source("cache_misses_total", "counter", "Cache lookups that went to disk, by cache.",
+                       lambda: {name: c.misses for name, c in caches.items()}, label="cache")
+    METRICS.add_source("cache_hit_ratio", "gauge", "Hits over lookups since start, by cache.",
+                       lambda: {name: cache_ratio(c.hits, c.misses) for name, c in caches.items()},
+                       label="cache")
+
+def is_metrics_path(path: str) -> bool:
+    return bool(METRICS_PATH) and path in (METRICS_PATH, METRICS_PATH + ".json")
+
+def metrics_response(path: str, keep_alive: bool):
+    if path.endswith(".json"):
+        body, ctype = METRICS.json(), "application/json"
+    else:
+        body, ctype = METRICS.prometheus(), "text/plain; version=0.0.4; charset=utf-8"
+    head = build_head(200, "OK", {"Content-Type": ctype, "Cache-Control": "no-store",
+                                  **connection_headers(keep_alive)}, len(body))
+    return FileResponse(head, None, [body])
+
+def open_access_log():
+    # Starts the writer thread; pre-forked workers call this after the fork
+    global ACCESS
+    if not ACCESS_LOG:
         return
+    ACCESS = AccessLog(ACCESS_LOG, ACCESS_LOG_MAX_BYTES, ACCESS_LOG_BACKUPS,
+                       ACCESS_LOG_QUEUE, ACCESS_LOG_FLUSH_SEC)
+    ACCESS.start()
+    METRICS.add_source("access_log_dropped_total", "counter", "Access log records dropped on a full queue.",
+                       lambda: ACCESS.dropped)
 
+def close_access_log():
+    if ACCESS is not None:
+        ACCESS.stop()
+
+def open_path_index(base_dir: str):
+    # Walks base_dir and starts the thread that keeps the index current;
+    # pre-forked workers call this after the fork, each with its own watches
+    global INDEX
+    if PATH_INDEX == "off":
+        return
+    index = PathIndex(base_dir, content_type_for, PATH_INDEX_MAX_ENTRIES, PATH_INDEX_RESCAN_SEC,
+                      on_give_up=drop_path_index)
+    started = time.perf_counter()
     try:
-        header_text = data.split(b"\r\n\r\n", 1)[0].decode("iso-8859-1")
-    except UnicodeDecodeError:
-        header_text = data.split(b"\r\n\r\n", 1)[0].decode("utf-8", "replace")
-
-    request_line = header_text.split("\r\n")[0]
-    parts = request_line.split(" ")
-    if len(parts) != 3:
-        resp = build_response(400, "Bad Request",
-                              {"Content-Type": "text/plain; charset=utf-8"},
-                              b"Bad Request")
-        conn.sendall(resp)
+        index.start(watch=PATH_INDEX != "rescan")
+    except IndexFull as e:
+        print(f"[path-index] {e}; serving without the index", file=sys.stderr)
         return
+    INDEX = index
+    print(f"Path index: {len(index.entries)} entries in {time.perf_counter() - started:.3f}s, "
+          f"kept current by {index.mode}")
+    METRICS.add_source("path_index_entries", "gauge", "Files and directories in the path index.",
+                       lambda: len(index.entries))
+    METRICS.add_source("path_index_misses_total", "counter", "Request paths not in the index, resolved on disk.",
+                       lambda: index.misses)
+    METRICS.add_source("path_index_rescans_total", "counter", "Full walks of the served tree.",
+                       lambda: index.rescans)
 
-    method, target, _ = parts
+def drop_path_index():
+    # The index gave up (tree too big); requests go straight to the disk again
+    global INDEX
+    INDEX = None
+
+def close_path_index():
+    if INDEX is not None:
+        INDEX.stop()
+
+def record(req, ip: str, resp, started: float):
+    # Called after the response went out; metrics label by path without the query string
+    if not METRICS_PATH and ACCESS is None:
+        return
+    status, size, elapsed = response_status(resp), response_size(resp), time.perf_counter() - started
+    if METRICS_PATH:
+        METRICS.observe(req[1].split("?", 1)[0], status, elapsed, size)
+    if ACCESS is not None:
+        ACCESS.log(ip, req[0], req[1], status, size, elapsed)
+
+def respond(req, base_dir: str, keep_alive: bool):
+    method, target, _, _ = req
+    conn_hdrs = connection_headers(keep_alive)
     if method != "GET":
-        resp = build_response(405, "Method Not Allowed",
-                              {"Content-Type": "text/plain; charset=utf-8"},
+        return build_response(405, "Method Not Allowed",
+                              {"Content-Type": "text/plain; charset=utf-8", **conn_hdrs},
                               b"Only GET is supported")
-        conn.sendall(resp)
-        return
 
     path = urllib.parse.urlparse(target).path
     path = urllib.parse.unquote(path)
+    if is_metrics_path(path):
+        return metrics_response(path, keep_alive)
 
     try:
-        abs_path = safe_join(base_dir, "." + path)
+        abs_path, st, ctype = resolve_path(base_dir, path)
     except PermissionError:
-        resp = build_response(403, "Forbidden",
-                              {"Content-Type": "text/plain; charset=utf-8"},
+        return build_response(403, "Forbidden",
+                              {"Content-Type": "text/plain; charset=utf-8", **conn_hdrs},
                               b"Forbidden")
-        conn.sendall(resp)
-        return
 
     if DELAY_MS > 0:
         time.sleep(DELAY_MS / 1000.0)
 
-    if os.path.isdir(abs_path):
-        body = list_directory(abs_path, path if path.endswith("/") else path + "/")
-        resp = build_response(200, "OK",
-                              {"Content-Type": "text/html; charset=utf-8"},
-                              body)
-        conn.sendall(resp)
-        return
+    if st is not None and stat.S_ISDIR(st.st_mode):
+        ctype = "text/html; charset=utf-8"
+        encoding, vary = accepted_encoding(ctype, req[3], COMPRESS_MIN_SIZE)
+        body = list_directory(abs_path, path if path.endswith("/") else path + "/", encoding, st.st_mtime_ns)
+        enc_hdr = {"Content-Encoding": encoding} if encoding else {}
+        head = build_head(200, "OK", {"Content-Type": ctype, **vary, **enc_hdr, **conn_hdrs}, len(body))
+        return FileResponse(head, None, [body])
 
-    if not os.path.exists(abs_path) or not allowed_file(abs_path):
+    if st is None or not allowed_file(abs_path):
         error_path = os.path.join(base_dir, "404.html")
         with open(error_path, "rb") as f:
             body = f.read()
-        resp = build_response(404, "Not Found",
-                              {"Content-Type": "text/html; charset=utf-8"},
+        return build_response(404, "Not Found",
+                              {"Content-Type": "text/html; charset=utf-8", **conn_hdrs},
                               body)
-        conn.sendall(resp)
-        return
 
     try:
-        with open(abs_path, "rb") as f:
-            body = f.read()
+        return file_response(abs_path, {"Content-Type": ctype, **conn_hdrs}, req[3], st)
     except OSError:
-        resp = build_response(500, "Internal Server Error",
-                              {"Content-Type": "text/plain; charset=utf-8"},
+        return build_response(500, "Internal Server Error",
+                              {"Content-Type": "text/plain; charset=utf-8", **conn_hdrs},
                               b"Failed to read file")
-        conn.sendall(resp)
-        return
 
-    ctype = content_type_for(abs_path)
-    resp = build_response(200, "OK", {"Content-Type": ctype}, body)
-    conn.sendall(resp)
+def handle_request(conn, base_dir: str):
+    ip = conn.getpeername()[0]
+    reader = HeadReader()
+    served = 0
+    while True:
+        try:
+            head = read_request(conn, reader, 2.0 if served == 0 else KEEPALIVE_TIMEOUT)
+            if not head:
+                return
+            served += 1
+            req = parse_request_head(head)
+        except socket.timeout:
+            return
+        except HeadError as e:
+            send_and_close(conn, bad_request(e), linger=0.2)
+            return
+
+        started = time.perf_counter()
+        keep_alive = wants_keep_alive(req[2], req[3]) and served < MAX_KEEPALIVE_REQUESTS
+        if keep_alive:
+            discard_body(conn, reader, req[3])
+        resp = respond(req, base_dir, keep_alive)
+        send_response(conn, resp)
+        record(req, ip, resp, started)
+        if not keep_alive:
+            return
 
 def main():
     if len(sys.argv) != 2:
@@ -275,11 +760,23 @@ def main():
         s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         s.bind((HOST, PORT))
         s.listen(5)
+        register_cache_metrics(DIR_CACHE)
+        open_access_log()
+        open_path_index(base_dir)
         print(f"Serving {base_dir} on http://{HOST}:{PORT} ...")
-        while True:
-            conn, addr = s.accept()
-            with conn:
-                handle_request(conn, base_dir)
+        try:
+            while True:
+                conn, addr = s.accept()
+                METRICS.connection_opened()
+                with conn:
+                    try:
+                        handle_request(conn, base_dir)
+                    except OSError:
+                        pass  # client reset or vanished mid-request; keep serving others
+                METRICS.connection_closed()
+        finally:
+            close_path_index()
+            close_access_log()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,11 +1,17 @@
 #!/usr/bin/env python3
 import argparse
+import asyncio
+import json
 import os
+import platform
+import random
 import sys
 import time
 import socket
 import subprocess
+import tempfile
 import threading
+from collections import Counter
 from http.client import HTTPConnection
 
 REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
@@ -16,6 +22,13 @@ HOST = os.environ.get('HOST', '127.0.0.1')
 PORT = int(os.environ.get('PORT', '8080'))
 BASE_URL = f"http://{HOST}:{PORT}"
 
+sys.path.append(REPO_ROOT)
+from lab1_http.httpparse import HeadError, parse_response_head, content_length
+
+# Why http_get returned -1, by exception type; the demos print it when non-empty
+HTTP_ERRORS = Counter()
+_errors_lock = threading.Lock()
+
 
 def http_get(path: str, timeout=100.0) -> int: # adjust timeout
     conn = HTTPConnection(HOST, PORT, timeout=timeout)
@@ -28,7 +41,9 @@ def http_get(path: str, timeout=100.0) -> int: # adjust timeout
         finally:
             conn.close()
         return status
-    except Exception:
+    except Exception as e:
+        with _errors_lock:
+            HTTP_ERRORS[type(e).__name__] += 1
         try:
             conn.close()
         except Exception:
@@ -36,6 +51,13 @@ def http_get(path: str, timeout=100.0) -> int: # adjust timeout
         return -1
 
 
+def report_http_errors():
+    with _errors_lock:
+        if HTTP_ERRORS:
+            print('Client errors: ' + ', '.join(f'{k} x{v}' for k, v in HTTP_ERRORS.most_common()))
+            HTTP_ERRORS.clear()
+
+
 def run_concurrent(n: int, path: str) -> float:
     start = time.perf_counter()
     statuses = [None] * n
@@ -97,46 +119,16 @@ class ServerProc:
         self.p = None
 
 
-# -------------- HTML parsing helper for listing --------------
-
-def parse_listing_hits(html: str, entry_name: str) -> int:
-    # Very simple parsing: find anchor for entry_name and read the number in the following <td class='num'>X</td>
-    # We look for href="{entry_name}" or href="{entry_name}/" as produced by server_mt.py
-    variants = [f'"{entry_name}"', f'"{entry_name}/"']
-    idx = -1
-    for v in variants:
-        idx = html.find(f'<a href={v}>')
-        if idx != -1:
-            break
-    if idx == -1:
-        return -1
-    # Find next td with class='num'
-    td_start = html.find("<td class='num'>", idx)
-    if td_start == -1:
-        td_start = html.find('class="num"', idx)
-        if td_start != -1:
-            td_start = html.find('>', td_start) + 1
-    else:
-        td_start += len("<td class='num'>")
-    if td_start == -1:
-        return -1
-    td_end = html.find('</td>', td_start)
-    if td_end == -1:
-        return -1
-    num_str = html[td_start:td_end].strip()
-    try:
-        return int(num_str)
-    except ValueError:
-        return -1
-
+# -------------- Server metrics --------------
 
-def get_listing_html(path: str = '/') -> str:
+def get_metrics() -> dict:
+    # The server's /metrics.json; listing hit counters are under "listing_hits_total"
     conn = HTTPConnection(HOST, PORT, timeout=5.0)
-    conn.request('GET', path)
+    conn.request('GET', '/metrics.json')
     resp = conn.getresponse()
-    body = resp.read().decode('utf-8', 'replace')
+    body = resp.read()
     conn.close()
-    return body
+    return json.loads(body)
 
 
 def bench_concurrency(delay_ms=100, n=10):
@@ -150,35 +142,24 @@ def bench_concurrency(delay_ms=100, n=10):
         dt_st = run_concurrent(n, '/')
         print(f"ST server handled {n} concurrent requests in {dt_st:.4f}s")
     print("Note: MT should be ~delay (≈1s), ST should be ≈ n * delay (≈10s) for n=10.")
+    report_http_errors()
 
 
 def bench_counter_race(target='/', requests=200, delay_ms=0):
     print(f"== Counter race test on {target} with {requests} concurrent requests ==")
     target = target if target.startswith('/') else '/' + target
 
-    if target.endswith('/'): # Directory
-        entry_name = target.strip('/').split('/')[-1]
-        parent = target.rstrip('/')  # '/books'
-        parent = parent.rsplit('/', 1)[0]
-        dir_path = '/' if parent == '' else parent + '/'
-    else: # File
-        dir_path = target.rsplit('/', 1)[0] or '/'
-        if not dir_path.endswith('/'):
-            dir_path += '/'
-        entry_name = target.strip('/').split('/')[-1]
-
     # Naive (racey)
     with ServerProc(MT_SERVER, WWW_DIR, env_overrides={'USE_LOCK': '0', 'DELAY_MS': str(delay_ms), 'RATE_LIMIT': '0'}):
         dt = run_concurrent(requests, target)
-        html = get_listing_html(dir_path)
-        hits_naive = parse_listing_hits(html, entry_name)
+        hits_naive = get_metrics()['listing_hits_total'].get(target, 0)
         print(f"Naive (no lock) time {dt:.3f}s, counted hits={hits_naive} (expected {requests})")
     # Locked (correct)
     with ServerProc(MT_SERVER, WWW_DIR, env_overrides={'USE_LOCK': '1', 'DELAY_MS': str(delay_ms), 'RATE_LIMIT': '0'}):
         dt = run_concurrent(requests, target)
-        html = get_listing_html(dir_path)
-        hits_locked = parse_listing_hits(html, entry_name)
+        hits_locked = get_metrics()['listing_hits_total'].get(target, 0)
         print(f"Locked (with lock) time {dt:.3f}s, counted hits={hits_locked} (expected {requests})")
+    report_http_errors()
 
 
 def bench_rate_limit(duration=10.0, rate_limit=5):
@@ -237,10 +218,382 @@ def bench_rate_limit(duration=10.0, rate_limit=5):
         print(f"Spammer: {spam_ok} OK, {spam_block} blocked (avg {spam_ok/duration:.1f} OK/s)")
         print(f"Polite:  {pol_ok} OK, {pol_block} blocked (avg {pol_ok/duration:.1f} OK/s)")
         print("Expectation: Spammer gets mostly 429; Polite stays under limit and should see near-zero 429s.")
+    report_http_errors()
+
+
+# -------------- Open-loop load generator --------------
+
+class LatencyHistogram:
+    # HdrHistogram-style log-linear buckets over microseconds: each power of two
+    # is split into 2**SUB_BITS linear slots, so any reported percentile is
+    # within 1/128 of the true value while memory stays a few hundred counters.
+    SUB_BITS = 7
+
+    def __init__(self):
+        self.counts = Counter()
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    def record(self, seconds: float):
+        v = max(1, int(seconds * 1e6))
+        exp = max(0, v.bit_length() - self.SUB_BITS - 1)
+        self.counts[(exp << self.SUB_BITS) + (v >> exp)] += 1
+        self.total += 1
+        self.min = v if self.min is None else min(self.min, v)
+        self.max = max(self.max, v)
+
+    def bucket_value(self, idx: int) -> int:
+        # Midpoint of a bucket, in microseconds
+        if idx < 2 << self.SUB_BITS:
+            return idx
+        exp = (idx >> self.SUB_BITS) - 1
+        return ((idx - (exp << self.SUB_BITS)) << exp) + (1 << exp) // 2
+
+    def percentile(self, q: float) -> float:
+        # q in [0, 100]; returns milliseconds
+        if not self.total:
+            return 0.0
+        rank = max(1, int(q / 100.0 * self.total + 0.5))
+        seen = 0
+        for idx in sorted(self.counts):
+            seen += self.counts[idx]
+            if seen >= rank:
+                return min(self.bucket_value(idx), self.max) / 1000.0
+        return self.max / 1000.0
+
+
+def parse_path_mix(specs):
+    # ['/', '/index.html:3'] -> (['/', '/index.html'], [1.0, 3.0])
+    paths, weights = [], []
+    for spec in specs or ['/']:
+        path, sep, weight = spec.rpartition(':')
+        if not sep or not weight.replace('.', '', 1).isdigit():
+            path, weight = spec, '1'
+        paths.append(path if path.startswith('/') else '/' + path)
+        weights.append(float(weight))
+    return paths, weights
+
+
+async def read_http_response(reader: asyncio.StreamReader):
+    # Returns (status, bytes received, connection reusable)
+    head = await reader.readuntil(b'\r\n\r\n')
+    version, status, _, headers = parse_response_head(head[:-4])
+    length = content_length(headers)
+    if status in (204, 304) or (100 <= status < 200):
+        length = 0
+    if length is None:
+        body = await reader.read()
+        return status, len(head) + len(body), False
+    if length:
+        await reader.readexactly(length)
+    conn_tokens = headers.get('connection', '').lower()
+    keep = 'close' not in conn_tokens if version == 'HTTP/1.1' else 'keep-alive' in conn_tokens
+    return status, len(head) + length, keep
+
+
+async def run_load(paths, weights, rps: float, duration: float, connections: int,
+                   timeout: float = 5.0, seed: int = 1, keepalive: bool = True) -> dict:
+    # Open loop (rps > 0): request i is due at start + i/rps whether or not the
+    # server kept up, and its latency counts from that due time, so queueing
+    # behind a slow response is measured instead of hidden (coordinated omission).
+    # Closed loop (rps == 0): every connection sends its next request as soon as
+    # the previous one finished.
+    rng = random.Random(seed)
+    hist = LatencyHistogram()
+    errors = Counter()
+    stats = {'sent': 0, 'done': 0, 'ok': 0, 'bytes': 0}
+    queue = asyncio.Queue()
+    conn_hdr = '' if keepalive else 'Connection: close\r\n'
+    requests = {p: f'GET {p} HTTP/1.1\r\nHost: {HOST}:{PORT}\r\n{conn_hdr}User-Agent: lab2-bench\r\n\r\n'.encode()
+                for p in paths}
+    start = time.perf_counter()
+    deadline = start + duration
+
+    async def connection():
+        reader = writer = None
+        while True:
+            if rps > 0:
+                due = await queue.get()
+            else:
+                if time.perf_counter() >= deadline:
+                    break
+                due = time.perf_counter()
+            path = rng.choices(paths, weights)[0]
+            stats['sent'] += 1
+            try:
+                if writer is None:
+                    reader, writer = await asyncio.wait_for(asyncio.open_connection(HOST, PORT), timeout)
+                writer.write(requests[path])
+                status, nbytes, keep = await asyncio.wait_for(read_http_response(reader), timeout)
+                hist.record(time.perf_counter() - due)
+                stats['bytes'] += nbytes
+                if status < 400:
+                    stats['ok'] += 1
+                else:
+                    errors[f'HTTP {status}'] += 1
+                if not keep:
+                    writer.close()
+                    writer = None
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError,
+                    asyncio.LimitOverrunError, HeadError) as e:
+                errors[type(e).__name__] += 1
+                if writer is not None:
+                    writer.close()
+                    writer = None
+            finally:
+                if rps > 0:
+                    queue.task_done()
+            stats['done'] += 1
+        if writer is not None:
+            writer.close()
+
+    async def schedule():
+        interval = 1.0 / rps
+        i = 0
+        while True:
+            due = start + i * interval
+            if due >= deadline:
+                return i
+            now = time.perf_counter()
+            if due > now:
+                await asyncio.sleep(due - now)
+            queue.put_nowait(due)
+            i += 1
+
+    workers = [asyncio.create_task(connection()) for _ in range(connections)]
+    if rps > 0:
+        scheduled = await schedule()
+        try:
+            await asyncio.wait_for(queue.join(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        for w in workers:
+            w.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        if scheduled > stats['done']:   # still queued or in flight when the run ended
+            errors['unfinished'] += scheduled - stats['done']
+    else:
+        await asyncio.gather(*workers)
+    elapsed = time.perf_counter() - start
+
+    return {
+        'target_rps': rps,
+        'connections': connections,
+        'keepalive': keepalive,
+        'duration': elapsed,
+        'sent': stats['sent'],
+        'ok': stats['ok'],
+        'errors': dict(errors.most_common()),
+        'rps': stats['ok'] / elapsed,
+        'bytes_per_sec': stats['bytes'] / elapsed,
+        'latency_ms': {
+            'min': (hist.min or 0) / 1000.0,
+            'p50': hist.percentile(50),
+            'p90': hist.percentile(90),
+            'p99': hist.percentile(99),
+            'p999': hist.percentile(99.9),
+            'max': hist.max / 1000.0,
+        },
+    }
+
+
+def print_load_report(res: dict):
+    lat = res['latency_ms']
+    n_err = sum(res['errors'].values())
+    print(f"Requests: {res['sent']} sent, {res['ok']} ok, {n_err} errors in {res['duration']:.2f}s "
+          f"| {res['rps']:.1f} req/s | {res['bytes_per_sec'] / 1e6:.2f} MB/s")
+    print(f"Latency ms: min {lat['min']:.2f}  p50 {lat['p50']:.2f}  p90 {lat['p90']:.2f}  "
+          f"p99 {lat['p99']:.2f}  p99.9 {lat['p999']:.2f}  max {lat['max']:.2f}")
+    if res['errors']:
+        print('Errors: ' + ', '.join(f'{k} x{v}' for k, v in res['errors'].items()))
+
+
+def bench_load(server='none', paths=None, rps=200.0, duration=10.0, connections=32,
+               timeout=5.0, env=None):
+    paths, weights = parse_path_mix(paths)
+    mode = f'{rps:g} req/s open-loop' if rps > 0 else 'closed-loop'
+    mix = ', '.join(f'{p} ({w:g})' for p, w in zip(paths, weights))
+    print(f"== Load: {mode} for {duration:.1f}s over {connections} connections | paths: {mix} ==")
+    overrides = {'RATE_LIMIT': '0'}   # the limiter would turn a load test into a 429 test
+    overrides.update(env or {})
+
+    def run():
+        return asyncio.run(run_load(paths, weights, rps, duration, connections, timeout))
+
+    if server == 'none':
+        res = run()
+    else:
+        script = MT_SERVER if server == 'mt' else ST_SERVER
+        with ServerProc(script, WWW_DIR, env_overrides=overrides):
+            res = run()
+    print_load_report(res)
+    return res
+
+
+# -------------- Synthetic www tree and benchmark matrix --------------
+
+SYNTH_DIR = os.path.join(tempfile.gettempdir(), 'lab2-bench-www')
+MATRIX_SERVERS = {
+    # name -> (script, extra server environment)
+    'st': (ST_SERVER, {}),
+    'mt': (MT_SERVER, {'ENGINE': 'threads'}),
+    'async': (MT_SERVER, {'ENGINE': 'async'}),
+}
+MATRIX_FILES = ('small', 'large', 'listing')
+LATENCY_FLOOR_MS = 1.0   # p99 changes smaller than this are noise, whatever the ratio
+
+
+def synthetic_params(root=SYNTH_DIR):
+    # Parameters recorded by the last gen-www run in `root`, or None
+    try:
+        with open(os.path.join(root, '.synthetic.json')) as f:
+            params = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return params if isinstance(params, dict) else None
+
+
+def make_synthetic_www(root=SYNTH_DIR, small_files=500, depth=8, listing_files=2000,
+                       large_mb=8, seed=1) -> dict:
+    # Builds (once per parameter set) a tree with many small HTML pages, a deep
+    # directory chain, one directory with a large listing and a large PDF that
+    # does not fit the server's file cache. Returns {kind: url path}.
+    params = {'small_files': small_files, 'depth': depth, 'listing_files': listing_files,
+              'large_mb': large_mb, 'seed': seed}
+    paths = {
+        'small': '/small/page_0000.html',
+        'large': '/large/big.pdf',
+        'listing': '/listing/',
+        'deep': '/' + '/'.join(f'd{i}' for i in range(depth)) + '/page.html',
+    }
+    marker = os.path.join(root, '.synthetic.json')
+    recorded = synthetic_params(root)
+    if recorded == params:
+        return paths
+    if os.path.isdir(root) and os.listdir(root) and not os.path.exists(marker):
+        raise SystemExit(f"{root} is not empty and was not made by gen-www; refusing to write into it")
+    if recorded is not None:
+        print(f"Rebuilding {root}: it was generated with {recorded}, now {params}")
+    else:
+        print(f"Generating synthetic tree in {root} with {params}")
+
+    rng = random.Random(seed)
+    words = ['lorem', 'ipsum', 'dolor', 'sit', 'amet', 'socket', 'thread', 'server', 'cache', 'queue']
+
+    def page(title: str) -> bytes:
+        para = ' '.join(rng.choice(words) for _ in range(300))
+        return (f'<!doctype html><html><head><meta charset="utf-8"><title>{title}</title></head>'
+                f'<body><h1>{title}</h1><p>{para}</p></body></html>').encode()
+
+    def write(rel: str, data: bytes):
+        full = os.path.join(root, rel)
+        os.makedirs(os.path.dirname(full), exist_ok=True)
+        with open(full, 'wb') as f:
+            f.write(data)
+
+    write('index.html', page('Synthetic benchmark tree'))
+    write('404.html', page('404 Not Found'))
+    for i in range(small_files):
+        write(f'small/page_{i:04d}.html', page(f'Page {i}'))
+    write(paths['deep'].lstrip('/'), page('Deep page'))
+    for i in range(listing_files):
+        write(f'listing/entry_{i:05d}.html', b'<p>x</p>')
+    block = rng.randbytes(1024 * 1024)
+    os.makedirs(os.path.join(root, 'large'), exist_ok=True)
+    with open(os.path.join(root, paths['large'].lstrip('/')), 'wb') as f:
+        for _ in range(large_mb):
+            f.write(block)
+    with open(marker, 'w') as f:
+        json.dump(params, f)
+    return paths
+
+
+def scenario_key(server: str, connections: int, kind: str, keepalive: bool) -> str:
+    return f"{server}/c{connections}/{kind}/{'ka' if keepalive else 'close'}"
+
+
+def bench_matrix(servers, concurrency, kinds, keepalive_modes, duration=3.0, rps=0.0,
+                 timeout=5.0, www=None, out=None, baseline=None, threshold=0.10) -> int:
+    root = www or SYNTH_DIR
+    # Keep whatever tree gen-www built there; only a missing tree gets the defaults
+    params = synthetic_params(root) or {}
+    paths = make_synthetic_www(root, **params)
+    runs = [(c, k, ka) for c in concurrency for k in kinds for ka in keepalive_modes]
+    print(f"== Matrix: {len(servers) * len(runs)} scenarios x {duration:.1f}s on {root} ==")
+    results = []
+    for server in servers:
+        script, env = MATRIX_SERVERS[server]
+        with ServerProc(script, root, env_overrides={'RATE_LIMIT': '0', 'DELAY_MS': '0', **env}):
+            for connections, kind, keepalive in runs:
+                key = scenario_key(server, connections, kind, keepalive)
+                res = asyncio.run(run_load([paths[kind]], [1.0], rps, duration, connections,
+                                           timeout, keepalive=keepalive))
+                res.update({'key': key, 'server': server, 'kind': kind, 'path': paths[kind]})
+                results.append(res)
+                lat = res['latency_ms']
+                n_err = sum(res['errors'].values())
+                print(f"{key:28s} {res['rps']:9.1f} req/s  p50 {lat['p50']:8.2f}  p99 {lat['p99']:8.2f} ms"
+                      f"  {res['bytes_per_sec'] / 1e6:8.2f} MB/s  errors {n_err}")
+
+    doc = {
+        'meta': {
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'duration': duration,
+            'rps': rps,
+            'synthetic': synthetic_params(root),
+        },
+        'results': results,
+    }
+    if out:
+        with open(out, 'w') as f:
+            json.dump(doc, f, indent=2)
+        print(f"Results written to {out}")
+    if baseline:
+        with open(baseline) as f:
+            return compare_results(json.load(f), doc, threshold)
+    return 0
+
+
+def compare_results(base: dict, cur: dict, threshold: float = 0.10) -> int:
+    # Flags scenarios whose throughput dropped, or whose p99 latency grew, by
+    # more than `threshold` (a fraction). Returns the number of regressions.
+    old = {r['key']: r for r in base.get('results', [])}
+    regressions = 0
+    print(f"== Compare against baseline (threshold {threshold:.0%}) ==")
+    trees = base.get('meta', {}).get('synthetic'), cur.get('meta', {}).get('synthetic')
+    if None not in trees and trees[0] != trees[1]:
+        print(f"Warning: the trees differ (baseline {trees[0]}, current {trees[1]})")
+    for r in cur.get('results', []):
+        b = old.get(r['key'])
+        if b is None:
+            print(f"{r['key']:28s} new scenario")
+            continue
+        notes = []
+        if b['rps'] > 0 and r['rps'] < b['rps'] * (1 - threshold):
+            notes.append(f"throughput {b['rps']:.1f} -> {r['rps']:.1f} req/s")
+        p99_old, p99_new = b['latency_ms']['p99'], r['latency_ms']['p99']
+        if p99_new > p99_old * (1 + threshold) and p99_new - p99_old > LATENCY_FLOOR_MS:
+            notes.append(f"p99 {p99_old:.2f} -> {p99_new:.2f} ms")
+        if sum(r['errors'].values()) > sum(b['errors'].values()):
+            notes.append(f"errors {sum(b['errors'].values())} -> {sum(r['errors'].values())}")
+        delta = (r['rps'] / b['rps'] - 1) if b['rps'] else 0.0
+        status = 'REGRESSION' if notes else 'ok'
+        regressions += bool(notes)
+        print(f"{r['key']:28s} {status:10s} {delta:+7.1%} req/s" + (f"  ({'; '.join(notes)})" if notes else ''))
+    print(f"{regressions} regression(s)")
+    return regressions
 
 
 def main():
+    global HOST, PORT, WWW_DIR
     ap = argparse.ArgumentParser(description='Lab2 Benchmark and Demo for concurrent HTTP server')
+    ap.add_argument('--host', help='Server address (default $HOST or 127.0.0.1)')
+    ap.add_argument('--port', type=int, help='Server port (default $PORT or 8080)')
+    ap.add_argument('--www', help='Directory the demo and load servers serve (default lab1_http/www)')
     sub = ap.add_subparsers(dest='cmd')
 
     ap_conc = sub.add_parser('concurrency', help='Compare MT vs ST with artificial delay')
@@ -255,13 +608,76 @@ def main():
     ap_rate.add_argument('-d', '--duration', type=float, default=10.0, help='Test duration seconds (default 10.0)')
     ap_rate.add_argument('--limit', type=int, default=5, help='Rate limit per second (default 5)')
 
+    ap_load = sub.add_parser('load', help='Open-loop load test with latency percentiles')
+    ap_load.add_argument('--server', choices=['none', 'mt', 'st'], default='none',
+                         help='Start server_mt.py (mt) or lab1 server.py (st), or use one already on HOST:PORT (default none)')
+    ap_load.add_argument('-c', '--connections', type=int, default=32, help='Concurrent connections (default 32)')
+    ap_load.add_argument('-r', '--rps', type=float, default=200.0, help='Target requests/s, 0 = closed loop as fast as possible (default 200)')
+    ap_load.add_argument('-d', '--duration', type=float, default=10.0, help='Test duration seconds (default 10.0)')
+    ap_load.add_argument('-p', '--path', action='append', metavar='PATH[:WEIGHT]',
+                         help='Request path with optional weight; repeat for a mix (default /)')
+    ap_load.add_argument('--timeout', type=float, default=5.0, help='Per-request timeout seconds (default 5.0)')
+    ap_load.add_argument('-e', '--env', action='append', default=[], metavar='KEY=VALUE',
+                         help='Environment for the started server, e.g. -e ENGINE=async (repeatable)')
+
+    ap_matrix = sub.add_parser('matrix', help='Scenario grid on a synthetic tree, JSON results, baseline compare')
+    ap_matrix.add_argument('--servers', default='st,mt,async', help='Comma list of st, mt, async (default st,mt,async)')
+    ap_matrix.add_argument('-c', '--concurrency', default='1,16,64', help='Comma list of connection counts (default 1,16,64)')
+    ap_matrix.add_argument('--files', default=','.join(MATRIX_FILES),
+                           help='Comma list of small, large, listing, deep (default small,large,listing)')
+    ap_matrix.add_argument('--keepalive', default='on,off', help='Comma list of on, off (default on,off)')
+    ap_matrix.add_argument('-d', '--duration', type=float, default=3.0, help='Seconds per scenario (default 3.0)')
+    ap_matrix.add_argument('-r', '--rps', type=float, default=0.0, help='Target requests/s per scenario, 0 = closed loop (default 0)')
+    ap_matrix.add_argument('--timeout', type=float, default=5.0, help='Per-request timeout seconds (default 5.0)')
+    ap_matrix.add_argument('-o', '--out', default='bench_results.json', help='JSON results file (default bench_results.json)')
+    ap_matrix.add_argument('-b', '--baseline', help='Earlier results file to compare against')
+    ap_matrix.add_argument('--synthetic-dir', default=SYNTH_DIR, help=f'Where the synthetic tree lives (default {SYNTH_DIR})')
+    ap_matrix.add_argument('-t', '--threshold', type=float, default=0.10, help='Regression threshold as a fraction (default 0.10)')
+
+    ap_cmp = sub.add_parser('compare', help='Compare two matrix result files')
+    ap_cmp.add_argument('baseline', help='Baseline results JSON')
+    ap_cmp.add_argument('current', help='New results JSON')
+    ap_cmp.add_argument('-t', '--threshold', type=float, default=0.10, help='Regression threshold as a fraction (default 0.10)')
+
+    ap_gen = sub.add_parser('gen-www', help='Create the synthetic www tree used by matrix')
+    ap_gen.add_argument('--synthetic-dir', default=SYNTH_DIR, help=f'Target directory (default {SYNTH_DIR})')
+    ap_gen.add_argument('--small-files', type=int, default=500, help='Small HTML pages (default 500)')
+    ap_gen.add_argument('--depth', type=int, default=8, help='Depth of the deep directory chain (default 8)')
+    ap_gen.add_argument('--listing-files', type=int, default=2000, help='Entries in /listing/ (default 2000)')
+    ap_gen.add_argument('--large-mb', type=int, default=8, help='Size of /large/big.pdf in MiB (default 8)')
+
     args = ap.parse_args()
+    HOST = args.host or HOST
+    PORT = args.port or PORT
+    WWW_DIR = os.path.abspath(args.www) if args.www else WWW_DIR
     if args.cmd == 'concurrency':
         bench_concurrency(delay_ms=args.delay_ms, n=args.num)
     elif args.cmd == 'counter':
         bench_counter_race(target=args.path, requests=args.num)
     elif args.cmd == 'ratelimit':
         bench_rate_limit(duration=args.duration, rate_limit=args.limit)
+    elif args.cmd == 'load':
+        env = dict(kv.split('=', 1) for kv in args.env)
+        bench_load(server=args.server, paths=args.path, rps=args.rps, duration=args.duration,
+                   connections=args.connections, timeout=args.timeout, env=env)
+    elif args.cmd == 'matrix':
+        split = lambda v: [x.strip() for x in v.split(',') if x.strip()]
+        regressions = bench_matrix(split(args.servers), [int(c) for c in split(args.concurrency)],
+                                   split(args.files), [ka == 'on' for ka in split(args.keepalive)],
+                                   duration=args.duration, rps=args.rps, timeout=args.timeout,
+                                   www=args.synthetic_dir, out=args.out, baseline=args.baseline,
+                                   threshold=args.threshold)
+        sys.exit(1 if regressions else 0)
+    elif args.cmd == 'compare':
+        with open(args.baseline) as f:
+            base = json.load(f)
+        with open(args.current) as f:
+            cur = json.load(f)
+        sys.exit(1 if compare_results(base, cur, args.threshold) else 0)
+    elif args.cmd == 'gen-www':
+        root = os.path.abspath(args.synthetic_dir)
+        paths = make_synthetic_www(root, args.small_files, args.depth, args.listing_files, args.large_mb)
+        print(f"Synthetic tree in {root}: " + ', '.join(f'{k} {v}' for k, v in paths.items()))
     else:
         ap.print_help()
         sys.exit(1)
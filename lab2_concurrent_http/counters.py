@@ -0,0 +1,53 @@
+import threading
+from collections import OrderedDict, defaultdict
+
+class ShardedCounter:
+    # Counter map split into lock-striped shards: threads bumping different
+    # keys rarely share a mutex, and reads never stop the writers globally.
+    def __init__(self, shards: int = 16):
+        self.shards = [(threading.Lock(), defaultdict(int)) for _ in range(max(1, shards))]
+
+    def shard(self, key):
+        return self.shards[hash(key) % len(self.shards)]
+
+    def inc(self, key, n: int = 1):
+        lock, counts = self.shard(key)
+        with lock:
+            counts[key] += n
+
+    def get(self, key) -> int:
+        # A single dict lookup is atomic under the GIL, no lock needed
+        return self.shard(key)[1].get(key, 0)
+
+    def snapshot(self) -> dict:
+        merged = {}
+        for lock, counts in self.shards:
+            with lock:
+                merged.update(counts)
+        return merged
+
+    def total(self) -> int:
+        return sum(self.snapshot().values())
+
+class BoundedCounter(ShardedCounter):
+    # ShardedCounter for keys an outside party chooses (client IPs): each shard
+    # keeps at most max_entries // shards keys, ordered by last increment, and
+    # folds the count of the one it drops into `evicted` so total() stays exact.
+    def __init__(self, shards: int = 16, max_entries: int = 4096):
+        shards = max(1, shards)
+        self.shards = [(threading.Lock(), OrderedDict()) for _ in range(shards)]
+        self.max_per_shard = max(1, max_entries // shards)
+        self.evicted = [0] * shards
+
+    def inc(self, key, n: int = 1):
+        i = hash(key) % len(self.shards)
+        lock, counts = self.shards[i]
+        with lock:
+            counts[key] = counts.get(key, 0) + n
+            counts.move_to_end(key)
+            if len(counts) > self.max_per_shard:
+                _, dropped = counts.popitem(last=False)
+                self.evicted[i] += dropped
+
+    def total(self) -> int:
+        return super().total() + sum(self.evicted)
@@ -0,0 +1,77 @@
+# Write-behind persistence for the listing hit counters (HITS_FILE). Requests
+# only ever bump the in-memory counters; a background thread takes a snapshot
+# every HITS_FLUSH_SEC and, if anything changed, rewrites one small JSON file
+# (temp file + fsync + rename, so a crash leaves the old or the new snapshot,
+# never half of one). The counts are loaded back at startup and written once
+# more on shutdown. With PROCESSES > 1 only the parent does this.
+import json
+import os
+import sys
+import threading
+
+FORMAT_VERSION = 1
+
+class HitStore:
+    def __init__(self, path: str, interval: float):
+        self.path = os.path.abspath(path)
+        self.interval = max(0.1, interval)
+        self.saved = {}            # counts as of the last successful write
+        self.snapshot = None
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.lock = threading.Lock()   # the timer thread and the final flush never write together
+
+    def load(self) -> dict:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                doc = json.load(f)
+            hits = doc["hits"]
+            counts = {str(k): int(v) for k, v in hits.items() if int(v) > 0}
+        except FileNotFoundError:
+            counts = {}
+        except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+            print(f"[hits] ignoring unreadable {self.path}: {e!r}", file=sys.stderr)
+            counts = {}
+        self.saved = dict(counts)
+        return counts
+
+    def save(self, counts: dict):
+        tmp = f"{self.path}.tmp"
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"version": FORMAT_VERSION, "hits": counts}, f, separators=(",", ":"), sort_keys=True)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+    def flush(self) -> bool:
+        # Writes only when the counts moved since the last write
+        with self.lock:
+            counts = self.snapshot()
+            if counts == self.saved:
+                return False
+            try:
+                self.save(counts)
+            except OSError as e:
+                print(f"[hits] could not write {self.path}: {e!r}", file=sys.stderr)
+                return False
+            self.saved = counts
+            return True
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            self.flush()
+
+    def start(self, snapshot):
+        # `snapshot` returns the current {path: count}; it runs on the flush thread only
+        self.snapshot = snapshot
+        self.thread = threading.Thread(target=self._run, name="hits-flush", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.thread is None:
+            return
+        self.stop_event.set()
+        self.thread.join(self.interval + 1)
+        self.thread = None
+        self.flush()
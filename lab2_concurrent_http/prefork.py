@@ -0,0 +1,84 @@
+# Pre-fork launcher for server_mt.py (PROCESSES > 1). The parent sets up shared
+# counters, forks N workers that each run the normal engine, and supervises them:
+#   - a worker that dies is replaced,
+#   - SIGHUP replaces the workers one by one (new one up first, then the old one
+#     gets SIGTERM and finishes its in-flight requests),
+#   - SIGTERM / SIGINT stop everything.
+# Each worker binds its own SO_REUSEPORT socket so the kernel spreads connections
+# over them; without SO_REUSEPORT they share one socket inherited from the parent.
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import time
+
+def run(base_dir: str, app):
+    ctx = multiprocessing.get_context("fork")
+    app.STATE.share(ctx)
+    app.open_hit_store()   # the parent loads and flushes the shared counters; workers never write the file
+
+    reuseport = app.REUSEPORT and hasattr(socket, "SO_REUSEPORT")
+    shared_sock = None if reuseport else app.make_listener()
+
+    def worker():
+        signal.signal(signal.SIGINT, signal.SIG_IGN)    # the parent decides when workers stop
+        signal.signal(signal.SIGHUP, signal.SIG_DFL)
+        s = shared_sock if shared_sock is not None else app.make_listener(reuseport=True)
+        app.open_access_log()   # threads do not survive fork, so each worker starts its own writer
+        app.open_path_index(base_dir)   # likewise its own index thread and inotify watches
+        print(f"[worker {os.getpid()}] ready", flush=True)
+        try:
+            with s:
+                app.serve(s, base_dir, graceful=True)
+        finally:
+            app.close_path_index()
+            app.close_access_log()
+
+    def spawn():
+        p = ctx.Process(target=worker, daemon=False)
+        p.start()
+        return p
+
+    flags = {"stop": False, "restart": False}
+    def on_stop(signum, frame):
+        flags["stop"] = True
+    def on_hup(signum, frame):
+        flags["restart"] = True
+    signal.signal(signal.SIGTERM, on_stop)
+    signal.signal(signal.SIGINT, on_stop)
+    signal.signal(signal.SIGHUP, on_hup)
+
+    mode = "SO_REUSEPORT" if reuseport else "shared socket"
+    print(f"Serving {base_dir} on http://{app.HOST}:{app.PORT} ... ({app.PROCESSES} processes, {mode}, engine={app.ENGINE})")
+    workers = [spawn() for _ in range(app.PROCESSES)]
+
+    while not flags["stop"]:
+        time.sleep(0.2)
+        if flags["restart"]:
+            flags["restart"] = False
+            print(f"[prefork] rolling restart of {len(workers)} workers", flush=True)
+            for i, old in enumerate(workers):
+                workers[i] = spawn()
+                time.sleep(0.2)           # let the replacement start accepting
+                old.terminate()
+                old.join(app.GRACE_SEC + 1)
+                if flags["stop"]:
+                    break
+        for i, p in enumerate(workers):
+            if not p.is_alive() and not flags["stop"]:
+                print(f"[prefork] worker {p.pid} exited with {p.exitcode}, restarting", file=sys.stderr, flush=True)
+                workers[i] = spawn()
+
+    print("[prefork] stopping workers", flush=True)
+    for p in workers:
+        if p.is_alive():
+            p.terminate()
+    deadline = time.monotonic() + app.GRACE_SEC + 1
+    for p in workers:
+        p.join(max(0.0, deadline - time.monotonic()))
+        if p.is_alive():
+            p.kill()
+    if shared_sock is not None:
+        shared_sock.close()
+    app.close_hit_store()
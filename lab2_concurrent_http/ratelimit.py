@@ -0,0 +1,86 @@
+import threading
+import time
+from collections import OrderedDict, deque
+
+# Both limiters keep per-IP state in lock-striped OrderedDicts ordered by last
+# use. Every call trims a couple of entries off the cold end when they are idle
+# (their state equals a fresh client) or when the shard is over its size bound,
+# so the table stays bounded however many addresses show up.
+EVICT_PER_CALL = 2
+
+class _ShardedTable:
+    def __init__(self, shards: int, max_entries: int):
+        shards = max(1, shards)
+        self.shards = [(threading.Lock(), OrderedDict()) for _ in range(shards)]
+        self.max_per_shard = max(1, max_entries // shards)
+        self.evicted = 0
+
+    def shard(self, ip: str):
+        return self.shards[hash(ip) % len(self.shards)]
+
+    def trim(self, table: OrderedDict, idle):
+        for _ in range(EVICT_PER_CALL):
+            if not table:
+                return
+            ip, state = next(iter(table.items()))
+            if len(table) > self.max_per_shard or idle(state):
+                del table[ip]
+                self.evicted += 1
+            else:
+                return
+
+    def size(self) -> int:
+        return sum(len(t) for _, t in self.shards)
+
+class WindowLimiter:
+    # Sliding window: at most `limit` requests per `window` seconds (deque of timestamps)
+    def __init__(self, limit: int, window: float, shards: int = 16,
+                 max_entries: int = 65536, locked: bool = True):
+        self.limit = limit
+        self.window = window
+        self.locked = locked
+        self.table = _ShardedTable(shards, max_entries)
+
+    def _check(self, table: OrderedDict, ip: str, now: float) -> bool:
+        window_start = now - self.window
+        if self.locked:   # the unlocked demo mode must not reshape the table under other threads
+            self.table.trim(table, lambda d: not d or d[-1] < window_start)
+        dq = table.get(ip)
+        if dq is None:
+            dq = table[ip] = deque()
+        else:
+            table.move_to_end(ip)
+        while dq and dq[0] < window_start:
+            dq.popleft()
+        if len(dq) >= self.limit:
+            return True
+        dq.append(now)
+        return False
+
+    def limited(self, ip: str) -> bool:
+        now = time.monotonic()
+        lock, table = self.table.shard(ip)
+        if not self.locked:
+            return self._check(table, ip, now)
+        with lock:
+            return self._check(table, ip, now)
+
+class TokenBucketLimiter:
+    # Token bucket stored as GCRA: one float per IP, the theoretical arrival
+    # time (TAT) of the next conforming request. `burst` tokens, `rate` per second.
+    def __init__(self, rate: float, burst: int, shards: int = 16, max_entries: int = 65536):
+        self.interval = 1.0 / rate
+        self.tolerance = (max(1, burst) - 1) * self.interval
+        self.table = _ShardedTable(shards, max_entries)
+
+    def limited(self, ip: str) -> bool:
+        now = time.monotonic()
+        lock, table = self.table.shard(ip)
+        with lock:
+            self.table.trim(table, lambda t: t <= now)
+            tat = max(table.get(ip, now), now)
+            if tat - self.tolerance > now:
+                return True
+            table[ip] = tat + self.interval
+            table.move_to_end(ip)
+            return False
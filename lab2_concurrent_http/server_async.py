@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# asyncio engine for server_mt.py (ENGINE=async). One event loop holds every
+# connection, so an idle or slow client costs a StreamReader/transport pair
+# instead of a whole thread. Request parsing, routing, listings, hit counters
+# and rate limiting are the ones from server_mt, passed in as `app`. Building a
+# response can read, compress or scan the disk, so that part runs on a thread
+# pool of WORKERS threads and the loop only moves bytes.
+import asyncio
+import signal
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from lab1_http.httpparse import content_length
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+def raise_fd_limit():
+    if resource is None:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or soft < hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        except (ValueError, OSError):
+            pass
+
+async def read_head(reader: asyncio.StreamReader, timeout: float, app):
+    # StreamReader already searches only the newly received bytes; a head past
+    # its limit (MAX_HEADER_BYTES) becomes the same HeadError the threaded path raises
+    try:
+        head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout)
+        return head[:-4]
+    except asyncio.IncompleteReadError as e:
+        return e.partial.rstrip(b"\r\n")
+    except asyncio.LimitOverrunError:
+        raise app.HeadError(431, "Request Header Fields Too Large")
+    except (asyncio.TimeoutError, ConnectionError):
+        return b""
+
+async def discard_body(reader: asyncio.StreamReader, headers: dict, timeout: float, app):
+    # Bounded reads, like the threaded discard_body: readexactly(length) would
+    # buffer the whole declared body, however large, before dropping it
+    remaining = content_length(headers) or 0
+    while remaining > 0:
+        chunk = await asyncio.wait_for(reader.read(min(remaining, 65536)), timeout)
+        if not chunk:
+            raise asyncio.IncompleteReadError(b"", remaining)
+        remaining -= len(chunk)
+
+async def send_response(writer: asyncio.StreamWriter, resp):
+    if isinstance(resp, bytes):
+        writer.write(resp)
+        await writer.drain()
+        return
+    loop = asyncio.get_running_loop()
+    try:
+        # Head and in-memory parts go to the transport in one writelines call so
+        # they leave in one send; separate small writes can stall ~40 ms on the
+        # peer's delayed ACK. loop.sendfile flushes that buffer before it starts.
+        pending = [resp.head]
+        for part in resp.parts:
+            if isinstance(part, tuple):
+                writer.writelines(pending)
+                pending = []
+                # os.sendfile on the transport's socket, or chunked reads when unsupported
+                await loop.sendfile(writer.transport, resp.f, *part)
+            else:
+                pending.append(part)
+        writer.writelines(pending)
+        await writer.drain()
+    finally:
+        if resp.f is not None:
+            resp.f.close()
+
+async def reject_rate_limited(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, app):
+    writer.write(app.too_many_requests())
+    await writer.drain()
+    # Half-close and swallow the pending request so the close is a FIN, not a RST
+    if writer.can_write_eof():
+        writer.write_eof()
+    try:
+        await asyncio.wait_for(reader.read(65536), 0.1)
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+
+def make_handler(base_dir: str, app):
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        peer = writer.get_extra_info("peername") or ("?", 0)
+        loop = asyncio.get_running_loop()
+        try:
+            if app.rate_limited(peer[0]):
+                await reject_rate_limited(reader, writer, app)
+                return
+
+            served = 0
+            while True:
+                # StreamReader keeps whatever follows this head buffered, so
+                # pipelined requests are picked up by the next iteration.
+                try:
+                    head = await read_head(reader, app.READ_TIMEOUT if served == 0 else app.KEEPALIVE_TIMEOUT, app)
+                    if not head:
+                        return
+                    if served and app.rate_limited(peer[0]):
+                        await reject_rate_limited(reader, writer, app)
+                        return
+                    served += 1
+                    req = app.parse_request_head(head)
+                except app.HeadError as e:
+                    writer.write(app.bad_request(e))
+                    await writer.drain()
+                    return
+                started = time.perf_counter()
+                keep_alive = app.wants_keep_alive(req[2], req[3]) and served < app.MAX_KEEPALIVE_REQUESTS
+                if keep_alive:
+                    await discard_body(reader, req[3], app.READ_TIMEOUT, app)
+
+                error, path, resolved = app.parse_request(req, base_dir, keep_alive)
+                if error:
+                    resp = error
+                    writer.write(error)
+                else:
+                    if app.DELAY_MS > 0:
+                        await asyncio.sleep(app.DELAY_MS / 1000.0)
+                    resp = await loop.run_in_executor(None, app.serve_path, path, resolved,
+                                                      base_dir, keep_alive, req[3])
+                    await send_response(writer, resp)
+                await writer.drain()
+                app.record(req, peer[0], resp, started)
+                if not keep_alive:
+                    return
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+            pass
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+    return handle
+
+async def run(sock, base_dir: str, app, graceful: bool = False):
+    handler = make_handler(base_dir, app)
+    active = set()
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max(1, app.WORKERS), thread_name_prefix="async-serve"))
+
+    async def tracked(reader, writer):
+        task = asyncio.current_task()
+        active.add(task)
+        app.METRICS.connection_opened()
+        try:
+            await handler(reader, writer)
+        finally:
+            active.discard(task)
+            app.METRICS.connection_closed()
+
+    server = await asyncio.start_server(tracked, sock=sock, limit=app.MAX_HEADER_BYTES)
+    stop = asyncio.Event()
+    if graceful:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set)
+    async with server:
+        if not graceful:
+            await server.serve_forever()
+            return
+        await stop.wait()
+        server.close()   # stop accepting; connections already open finish their request
+        if active:
+            _, pending = await asyncio.wait(set(active), timeout=app.GRACE_SEC)
+            for task in pending:
+                task.cancel()
+
+def serve(sock, base_dir: str, app, graceful: bool = False):
+    raise_fd_limit()
+    try:
+        asyncio.run(run(sock, base_dir, app, graceful))
+    except KeyboardInterrupt:
+        print("Shutting down", file=sys.stderr)
@@ -1,15 +1,31 @@
 #!/usr/bin/env python3
 import os
 import sys
+import math
+import stat
+import queue
+import signal
 import socket
 import threading
 import time
 import urllib.parse
 from html import escape
-from collections import defaultdict, deque
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from lab1_http.server import build_response, safe_join, allowed_file, content_type_for
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from lab1_http.server import (
+    build_response, resolve_path, allowed_file, file_response, send_response,
+    parse_request_head, HeadReader, HeadError, bad_request, send_and_close,
+    wants_keep_alive, connection_headers, read_request, discard_body,
+    KEEPALIVE_TIMEOUT, MAX_KEEPALIVE_REQUESTS, MAX_HEADER_BYTES, FILE_CACHE, DirCache,
+    build_head, FileResponse, accepted_encoding, compress_chunks, COMPRESS_MIN_SIZE, COMPRESS_LEVEL,
+    METRICS, is_metrics_path, metrics_response, record, register_cache_metrics,
+    open_access_log, close_access_log, open_path_index, close_path_index,
+)
+from counters import ShardedCounter, BoundedCounter
+from ratelimit import WindowLimiter, TokenBucketLimiter
+from shared_state import SharedCounterTable, SharedTokenBucketLimiter
+from hitstore import HitStore
 
 HOST = os.environ.get("HOST", "0.0.0.0")
 PORT = int(os.environ.get("PORT", "8080"))
@@ -18,14 +34,52 @@ DELAY_MS = int(os.environ.get("DELAY_MS", "0"))
 USE_LOCK = int(os.environ.get("USE_LOCK", "1")) == 1     # 0 = naive (racey), 1 = fixed
 RATE_LIMIT = int(os.environ.get("RATE_LIMIT", "5"))      # ~5 req/sec per client IP
 WINDOW_SEC = float(os.environ.get("WINDOW_SEC", "1.0"))  # sliding window in seconds
+RATE_MODE = os.environ.get("RATE_MODE", "window")        # "window" = sliding window, "bucket" = token bucket (GCRA)
+RATE_BURST = int(os.environ.get("RATE_BURST", str(RATE_LIMIT)))                          # bucket size
+RATE_REFILL = float(os.environ.get("RATE_REFILL", str(RATE_LIMIT / max(WINDOW_SEC, 1e-9))))  # tokens per second
+RATE_TABLE_SIZE = int(os.environ.get("RATE_TABLE_SIZE", "65536"))  # max tracked client IPs
+WORKERS = int(os.environ.get("WORKERS", "32"))           # fixed-size worker pool
+QUEUE_SIZE = int(os.environ.get("QUEUE_SIZE", "256"))    # bounded accept queue feeding the pool
+OVERLOAD = os.environ.get("OVERLOAD", "block")           # "block" = stop accepting, "503" = fast reject
+POOL_STATS_SEC = float(os.environ.get("POOL_STATS_SEC", "0"))  # 0 = no periodic pool report
+ENGINE = os.environ.get("ENGINE", "threads")             # "threads" = worker pool, "async" = asyncio event loop
+READ_TIMEOUT = float(os.environ.get("READ_TIMEOUT", "2.0"))
+COUNTER_SHARDS = int(os.environ.get("COUNTER_SHARDS", "16"))  # lock stripes for hits and rate-limit state
+PROCESSES = int(os.environ.get("PROCESSES", "1"))        # >1 = pre-forked worker processes (prefork.py)
+REUSEPORT = int(os.environ.get("REUSEPORT", "1")) == 1   # one SO_REUSEPORT socket per process, else one shared socket
+GRACE_SEC = float(os.environ.get("GRACE_SEC", "5.0"))    # how long a stopping worker finishes in-flight requests
+SHARED_SLOTS = int(os.environ.get("SHARED_SLOTS", "16384"))   # hit-counter slots in shared memory
+HITS_FILE = os.environ.get("HITS_FILE", "")                   # "" = hit counters are not persisted
+HITS_FLUSH_SEC = float(os.environ.get("HITS_FLUSH_SEC", "5.0"))  # how often changed counts are written
+
+def make_limiter(shards: int):
+    if RATE_LIMIT <= 0:
+        return None
+    if RATE_MODE == "bucket":
+        return TokenBucketLimiter(RATE_REFILL, RATE_BURST, shards, RATE_TABLE_SIZE)
+    return WindowLimiter(RATE_LIMIT, WINDOW_SEC, shards, RATE_TABLE_SIZE, locked=USE_LOCK)
 
 class ServerState:
-    def __init__(self):
-        self.hits = defaultdict(int)
-        self.ip_buckets = defaultdict(deque)
-        self.lock = threading.Lock()
-
-STATE = ServerState()
+    def __init__(self, shards: int):
+        self.hits = ShardedCounter(shards)
+        # The limiter keeps its own lock table, separate from the hit counters
+        self.limiter = make_limiter(shards)
+        self.rejected = BoundedCounter(shards, RATE_TABLE_SIZE)   # 429s per client IP, most recent offenders only
+
+    def share(self, ctx):
+        # Swap in shared-memory tables before forking so every worker process
+        # counts into, and limits against, the same state. Both rate-limit modes
+        # become a token bucket there (window mode: burst RATE_LIMIT per WINDOW_SEC).
+        self.hits = SharedCounterTable(ctx, SHARED_SLOTS)
+        self.rejected = SharedCounterTable(ctx, SHARED_SLOTS)
+        if self.limiter is not None:
+            if RATE_MODE == "bucket":
+                rate, burst = RATE_REFILL, RATE_BURST
+            else:
+                rate, burst = RATE_LIMIT / WINDOW_SEC, RATE_LIMIT
+            self.limiter = SharedTokenBucketLimiter(ctx, rate, burst, RATE_TABLE_SIZE)
+
+STATE = ServerState(COUNTER_SHARDS)
 
 def parent_href(url_path: str) -> str:
     if url_path in ("/", ""):
@@ -35,93 +89,50 @@ def parent_href(url_path: str) -> str:
     return "/" if cut <= 0 else parent[:cut] + "/"
 
 def inc_hit(url_path: str):
-    if USE_LOCK:
-        with STATE.lock:
-            STATE.hits[url_path] += 1
+    if USE_LOCK or PROCESSES > 1:
+        STATE.hits.inc(url_path)
     else:
-        cur = STATE.hits[url_path]
+        _, counts = STATE.hits.shard(url_path)
+        cur = counts[url_path]
         time.sleep(0.005) # add tiny sleeps to force interlacing
-        STATE.hits[url_path] = cur + 1
+        counts[url_path] = cur + 1
 
 def snapshot_hits():
-    if USE_LOCK:
-        with STATE.lock:
-            return dict(STATE.hits)
-    return dict(STATE.hits)
-
-def rate_limited(ip: str) -> bool:
-    if RATE_LIMIT <= 0:
-        return False
-    now = time.monotonic()
-    window_start = now - WINDOW_SEC
-    if USE_LOCK:
-        with STATE.lock:
-            dq = STATE.ip_buckets[ip]
-            while dq and dq[0] < window_start:
-                dq.popleft()
-            if len(dq) >= RATE_LIMIT:
-                return True
-            dq.append(now)
-            return False
-    else:
-        dq = STATE.ip_buckets[ip]
-        while dq and dq[0] < window_start:
-            dq.popleft()
-        if len(dq) >= RATE_LIMIT:
-            return True
-        dq.append(now)
-        return False
-
-def render_listing(absdir: str, url_norm: str) -> bytes:
-    parent = ""
-    if url_norm not in ("/", ""):
-        parent_trim = url_norm.rstrip("/")
-        cut = parent_trim.rfind("/")
-        parent = "/" if cut <= 0 else parent_trim[:cut] + "/"
+    return STATE.hits.snapshot()
 
-    try:
-        hits_map = snapshot_hits()
-    except NameError:
-        hits_map = {}
-
-    rows = []
-    if parent:
-        rows.append(
-            f"<tr>"
-            f"<td><a href=\"{escape(parent)}\">⬆ Parent directory</a></td>"
-            f"<td class='num'>–</td>"
-            f"</tr>"
-        )
+HIT_STORE = None
 
-    for name in sorted(os.listdir(absdir), key=str.lower):
-        if name in (".DS_Store", "404.html"):
-            continue
-
-        p = os.path.join(absdir, name)
-        is_dir = os.path.isdir(p)
-        disp = name + ("/" if is_dir else "")
-        href = urllib.parse.quote(name) + ("/" if is_dir else "")
-
-        if url_norm != "/":
-            hit_key = url_norm.rstrip("/") + "/" + name + ("/" if is_dir else "")
-        else:
-            hit_key = "/" + name + ("/" if is_dir else "")
+def open_hit_store():
+    # Seeds STATE.hits from HITS_FILE and starts the write-behind thread.
+    # Runs after STATE.share() so the counts land in the table workers will use.
+    global HIT_STORE
+    if not HITS_FILE:
+        return
+    HIT_STORE = HitStore(HITS_FILE, HITS_FLUSH_SEC)
+    saved = HIT_STORE.load()
+    for path, n in saved.items():
+        STATE.hits.inc(path, n)
+    HIT_STORE.start(snapshot_hits)
+    print(f"[MT] Hit counters: {HITS_FILE} ({len(saved)} paths loaded, flushed every {HITS_FLUSH_SEC:g}s)")
 
-        h = hits_map.get(hit_key, 0)
+def close_hit_store():
+    if HIT_STORE is not None:
+        HIT_STORE.stop()
 
-        rows.append(
-            f"<tr>"
-            f"<td><a href=\"{href}\">{escape(disp)}</a></td>"
-            f"<td class='num'>{h}</td>"
-            f"</tr>"
-        )
+def rate_limited(ip: str) -> bool:
+    if STATE.limiter is None:
+        return False
+    if STATE.limiter.limited(ip):
+        STATE.rejected.inc(ip)
+        return True
+    return False
 
-    page = f"""<!doctype html>
+LISTING_HEAD = """<!doctype html>
     <html>
       <head>
         <meta charset="utf-8"/>
         <meta name="viewport" content="width=device-width,initial-scale=1"/>
-        <title>Index of {escape(url_norm)}</title>
+        <title>Index of {title}</title>
         <style>
           :root {{
             --bg: #0b1020;
@@ -196,7 +207,7 @@ def render_listing(absdir: str, url_norm: str) -> bytes:
       <body>
         <div class="wrap">
           <header>
-            <h1>Index of <code>{escape(url_norm if url_norm else "/")}</code></h1>
+            <h1>Index of <code>{heading}</code></h1>
             <div class="legend">Click to open files or browse subdirectories.</div>
           </header>
           <section class="card">
@@ -205,7 +216,8 @@ def render_listing(absdir: str, url_norm: str) -> bytes:
                 <tr><th>File / Directory</th><th class="num">Hits</th></tr>
               </thead>
               <tbody>
-                {''.join(rows) if rows else '<tr><td>(empty)</td><td class="num">0</td></tr>'}
+                """
+LISTING_TAIL = """
               </tbody>
             </table>
           </section>
@@ -213,98 +225,359 @@ def render_listing(absdir: str, url_norm: str) -> bytes:
         </div>
       </body>
     </html>"""
-    return page.encode("utf-8")
 
-def handle_request(conn, addr, base_dir: str):
-    client_ip = addr[0]
-    if rate_limited(client_ip):
-        body = b"<!doctype html><html><body><h1>429 Too Many Requests</h1><p>Rate limit 5 req/s per IP.</p></body></html>"
-        resp = build_response(429, "Too Many Requests",
-                              {"Content-Type":"text/html; charset=utf-8"}, body)
-        conn.sendall(resp)
-        return
+DIR_CACHE = DirCache()
 
-    data = b""
-    conn.settimeout(2.0)
-    try:
-        while b"\r\n\r\n" not in data and len(data) < 65536:
-            chunk = conn.recv(4096)
-            if not chunk:
-                break
-            data += chunk
-    except socket.timeout:
-        return
-    if not data:
-        return
+def listing_rows(entries, url_norm: str):
+    # Static part of the listing: page head plus (row_prefix, hit_key) per entry.
+    # Only the hit column is filled in per request.
+    parent = ""
+    if url_norm not in ("/", ""):
+        parent_trim = url_norm.rstrip("/")
+        cut = parent_trim.rfind("/")
+        parent = "/" if cut <= 0 else parent_trim[:cut] + "/"
 
-    try:
-        header_text = data.split(b"\r\n\r\n", 1)[0].decode("iso-8859-1")
-    except UnicodeDecodeError:
-        header_text = data.split(b"\r\n\r\n", 1)[0].decode("utf-8", "replace")
-
-    request_line = header_text.split("\r\n")[0]
-    parts = request_line.split(" ")
-    if len(parts) != 3:
-        resp = build_response(400, "Bad Request", {"Content-Type":"text/plain; charset=utf-8"}, b"Bad Request")
-        conn.sendall(resp)
-        return
+    rows = []
+    if parent:
+        rows.append((
+            f"<tr>"
+            f"<td><a href=\"{escape(parent)}\">⬆ Parent directory</a></td>"
+            f"<td class='num'>–</td>"
+            f"</tr>",
+            None,
+        ))
+
+    for name, is_dir in entries:
+        if name in (".DS_Store", "404.html"):
+            continue
+
+        disp = name + ("/" if is_dir else "")
+        href = urllib.parse.quote(name) + ("/" if is_dir else "")
+
+        if url_norm != "/":
+            hit_key = url_norm.rstrip("/") + "/" + name + ("/" if is_dir else "")
+        else:
+            hit_key = "/" + name + ("/" if is_dir else "")
 
-    method, target, _ = parts
+        rows.append((
+            f"<tr>"
+            f"<td><a href=\"{href}\">{escape(disp)}</a></td>"
+            f"<td class='num'>",
+            hit_key,
+        ))
+
+    head = LISTING_HEAD.format(title=escape(url_norm), heading=escape(url_norm if url_norm else "/"))
+    return head, rows
+
+def render_listing(absdir: str, url_norm: str, mtime: int = None) -> bytes:
+    return "".join(listing_parts(absdir, url_norm, mtime)).encode("utf-8")
+
+def listing_parts(absdir: str, url_norm: str, mtime: int = None):
+    head, rows = DIR_CACHE.get(absdir, url_norm, lambda entries: listing_rows(entries, url_norm), mtime)
+
+    # A generator, so a compressor can consume the page row by row.
+    # Per-key reads instead of copying every counter under a lock.
+    hits_get = STATE.hits.get
+    yield head
+    for prefix, hit_key in rows:
+        if hit_key is None:
+            yield prefix
+        else:
+            yield f"{prefix}{hits_get(hit_key)}</td></tr>"
+    if not rows:
+        yield '<tr><td>(empty)</td><td class="num">0</td></tr>'
+    yield LISTING_TAIL
+
+RETRY_AFTER = max(1, math.ceil(WINDOW_SEC if RATE_MODE != "bucket" else 1.0 / max(RATE_REFILL, 1e-9)))
+_TOO_MANY = (0, b"")   # (unix second, prebuilt 429 response), swapped atomically
+
+def too_many_requests() -> bytes:
+    # The 429 only changes with the Date header, so rebuild it at most once a second
+    global _TOO_MANY
+    now = int(time.time())
+    sec, resp = _TOO_MANY
+    if sec != now:
+        body = (f"<!doctype html><html><body><h1>429 Too Many Requests</h1>"
+                f"<p>Rate limit {RATE_LIMIT} req/{WINDOW_SEC:g}s per IP.</p></body></html>").encode()
+        resp = build_response(429, "Too Many Requests",
+                              {"Content-Type":"text/html; charset=utf-8", "Retry-After": str(RETRY_AFTER)}, body)
+        _TOO_MANY = (now, resp)
+    return resp
+
+def reject_rate_limited(conn):
+    send_and_close(conn, too_many_requests())
+
+def parse_request(req, base_dir: str, keep_alive: bool):
+    # Returns (error_response, None, None) or (None, url_path, (abs_path, st, content type))
+    method, target, _, _ = req
+    conn_hdrs = connection_headers(keep_alive)
     if method != "GET":
         resp = build_response(405, "Method Not Allowed",
-                              {"Content-Type":"text/plain; charset=utf-8"},
+                              {"Content-Type":"text/plain; charset=utf-8", **conn_hdrs},
                               b"Only GET is supported")
-        conn.sendall(resp)
-        return
+        return resp, None, None
 
     path = urllib.parse.urlparse(target).path
     path = urllib.parse.unquote(path)
     try:
-        abs_path = safe_join(base_dir, "." + path)
+        resolved = resolve_path(base_dir, path)
     except PermissionError:
         resp = build_response(403, "Forbidden",
-                              {"Content-Type": "text/plain; charset=utf-8"},
+                              {"Content-Type": "text/plain; charset=utf-8", **conn_hdrs},
                               b"Forbidden")
-        conn.sendall(resp)
-        return
-
-    if DELAY_MS > 0:
-        time.sleep(DELAY_MS / 1000.0)
-
-    if os.path.isdir(abs_path):
+        return resp, None, None
+    return None, path, resolved
+
+def serve_path(path: str, resolved, base_dir: str, keep_alive: bool = False, req_headers: dict = None):
+    conn_hdrs = connection_headers(keep_alive)
+    if is_metrics_path(path):
+        return metrics_response(path, keep_alive)
+    abs_path, st, ctype = resolved
+    if st is not None and stat.S_ISDIR(st.st_mode):
         url_norm = path if path.endswith("/") else path + "/"
         inc_hit(url_norm)
-        body = render_listing(abs_path, url_norm)
-        resp = build_response(200, "OK", {"Content-Type":"text/html; charset=utf-8"}, body)
-        conn.sendall(resp)
-        return
-
-    if not os.path.exists(abs_path) or not allowed_file(abs_path):
+        ctype = "text/html; charset=utf-8"
+        encoding, vary = accepted_encoding(ctype, req_headers, COMPRESS_MIN_SIZE)
+        if encoding:
+            # Rows are generated and fed to the compressor one by one; only the
+            # compressed chunks are kept, as Content-Length needs their total size
+            chunks = list(compress_chunks(listing_parts(abs_path, url_norm, st.st_mtime_ns), encoding, COMPRESS_LEVEL))
+            head = build_head(200, "OK", {"Content-Type": ctype, **vary, "Content-Encoding": encoding, **conn_hdrs},
+                              sum(len(c) for c in chunks))
+            return FileResponse(head, None, chunks)
+        body = render_listing(abs_path, url_norm, st.st_mtime_ns)
+        head = build_head(200, "OK", {"Content-Type": ctype, **vary, **conn_hdrs}, len(body))
+        return FileResponse(head, None, [body])
+
+    if st is None or not allowed_file(abs_path):
         error_path = os.path.join(base_dir, "404.html")
         with open(error_path, "rb") as f:
             body = f.read()
-        resp = build_response(404, "Not Found", {"Content-Type":"text/html; charset=utf-8"}, body)
-        conn.sendall(resp)
-        return
+        return build_response(404, "Not Found", {"Content-Type":"text/html; charset=utf-8", **conn_hdrs}, body)
 
     try:
-        with open(abs_path, "rb") as f:
-            body = f.read()
+        resp = file_response(abs_path, {"Content-Type": ctype, **conn_hdrs}, req_headers, st)
     except OSError:
-        resp = build_response(500, "Internal Server Error",
-                              {"Content-Type": "text/plain; charset=utf-8"},
+        return build_response(500, "Internal Server Error",
+                              {"Content-Type": "text/plain; charset=utf-8", **conn_hdrs},
                               b"Failed to read file")
-        conn.sendall(resp)
-        return
 
     inc_hit(path if path.startswith("/") else "/" + path)
-    ctype = content_type_for(abs_path)
-    resp = build_response(200, "OK", {"Content-Type": ctype}, body)
-    conn.sendall(resp)
+    return resp
+
+def handle_request(conn, addr, base_dir: str):
+    client_ip = addr[0]
+    if rate_limited(client_ip):
+        reject_rate_limited(conn)
+        return
+
+    reader = HeadReader(MAX_HEADER_BYTES)
+    served = 0
+    while True:
+        try:
+            head = read_request(conn, reader, READ_TIMEOUT if served == 0 else KEEPALIVE_TIMEOUT)
+            if not head:
+                return
+            # The first request was checked before reading; later ones on a kept-alive connection here
+            if served and rate_limited(client_ip):
+                reject_rate_limited(conn)
+                return
+            served += 1
+            req = parse_request_head(head)
+        except socket.timeout:
+            return
+        except HeadError as e:
+            send_and_close(conn, bad_request(e), linger=0.2)
+            return
+        started = time.perf_counter()
+        keep_alive = wants_keep_alive(req[2], req[3]) and served < MAX_KEEPALIVE_REQUESTS
+        if keep_alive:
+            discard_body(conn, reader, req[3])
+
+        error, path, resolved = parse_request(req, base_dir, keep_alive)
+        if error:
+            resp = error
+            conn.sendall(error)
+        else:
+            if DELAY_MS > 0:
+                time.sleep(DELAY_MS / 1000.0)
+            resp = serve_path(path, resolved, base_dir, keep_alive, req[3])
+            send_response(conn, resp)
+        record(req, client_ip, resp, started)
+        if not keep_alive:
+            return
 
 def handle_client(conn, addr, base_dir):
-    with conn:
-        handle_request(conn, addr, base_dir)
+    METRICS.connection_opened()
+    try:
+        with conn:
+            handle_request(conn, addr, base_dir)
+    finally:
+        METRICS.connection_closed()
+
+class WorkerPool:
+    def __init__(self, size: int, queue_size: int, handler, overload: str = "block"):
+        self.size = size
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.handler = handler
+        self.overload = overload
+        self.lock = threading.Lock()   # pool bookkeeping only, never the counter locks
+        self.busy = 0
+        self.busy_time = 0.0
+        self.served = 0
+        self.rejected = 0
+        self.peak_depth = 0
+
+    def start(self):
+        for i in range(self.size):
+            threading.Thread(target=self._worker, name=f"worker-{i}", daemon=True).start()
+
+    def _worker(self):
+        while True:
+            conn, addr = self.queue.get()
+            with self.lock:
+                self.busy += 1
+            t0 = time.monotonic()
+            try:
+                self.handler(conn, addr)
+            except OSError:
+                pass
+            except Exception as e:
+                print(f"[pool] error handling {addr}: {e!r}", file=sys.stderr)
+            finally:
+                dt = time.monotonic() - t0
+                with self.lock:
+                    self.busy -= 1
+                    self.busy_time += dt
+                    self.served += 1
+
+    def wait_idle(self, timeout: float):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self.lock:
+                busy = self.busy
+            if busy == 0 and self.queue.empty():
+                return
+            time.sleep(0.05)
+
+    def submit(self, conn, addr) -> bool:
+        if self.overload == "503":
+            try:
+                self.queue.put_nowait((conn, addr))
+            except queue.Full:
+                with self.lock:
+                    self.rejected += 1
+                return False
+        else:
+            self.queue.put((conn, addr))   # blocks the accept loop while the queue is full
+        depth = self.queue.qsize()
+        if depth > self.peak_depth:
+            self.peak_depth = depth
+        return True
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "workers": self.size,
+                "busy": self.busy,
+                "busy_time": self.busy_time,
+                "served": self.served,
+                "rejected": self.rejected,
+                "queue_depth": self.queue.qsize(),
+                "queue_size": self.queue.maxsize,
+                "peak_depth": self.peak_depth,
+            }
+
+def reject_overloaded(conn):
+    body = b"Server busy, retry shortly"
+    resp = build_response(503, "Service Unavailable",
+                          {"Content-Type": "text/plain; charset=utf-8", "Retry-After": "1"},
+                          body)
+    try:
+        conn.settimeout(0.5)
+        conn.sendall(resp)
+    except OSError:
+        pass
+    finally:
+        conn.close()
+
+def report_pool(pool: WorkerPool, interval: float):
+    prev = pool.stats()
+    while True:
+        time.sleep(interval)
+        cur = pool.stats()
+        util = (cur["busy_time"] - prev["busy_time"]) / (interval * cur["workers"])
+        print(f"[pool] busy {cur['busy']}/{cur['workers']} | util {min(util, 1.0) * 100:.1f}% | "
+              f"queue {cur['queue_depth']}/{cur['queue_size']} (peak {cur['peak_depth']}) | "
+              f"served {cur['served'] - prev['served']} | rejected {cur['rejected'] - prev['rejected']}")
+        rejected = STATE.rejected.snapshot()
+        if rejected:
+            top = sorted(rejected.items(), key=lambda kv: kv[1], reverse=True)[:3]
+            print(f"[ratelimit] rejected {STATE.rejected.total()} total | top "
+                  + ", ".join(f"{ip}={n}" for ip, n in top))
+        if FILE_CACHE.enabled:
+            c = FILE_CACHE.stats()
+            print(f"[cache] {c['entries']} files, {c['bytes']}/{c['max_bytes']} bytes | "
+                  f"hits {c['hits']} | misses {c['misses']} | evictions {c['evictions']}")
+        prev = cur
+
+def register_metrics():
+    # Numbers kept elsewhere, read only when /metrics is scraped. With PROCESSES > 1
+    # hits and rejections come from the shared tables, request metrics are per worker.
+    register_cache_metrics(DIR_CACHE)
+    METRICS.add_source("listing_hits_total", "counter", "Hit counter shown in directory listings, by path.",
+                       snapshot_hits, label="path")
+    METRICS.add_source("http_rate_limited_total", "counter", "Connections answered with 429.",
+                       lambda: STATE.rejected.total())
+
+def register_pool_metrics(pool: WorkerPool):
+    METRICS.add_source("pool_workers_busy", "gauge", "Worker threads handling a connection.",
+                       lambda: pool.stats()["busy"])
+    METRICS.add_source("pool_queue_depth", "gauge", "Accepted connections waiting for a worker.",
+                       lambda: pool.stats()["queue_depth"])
+    METRICS.add_source("pool_rejected_total", "counter", "Connections answered with 503 (OVERLOAD=503).",
+                       lambda: pool.stats()["rejected"])
+
+def make_listener(reuseport: bool = False):
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuseport:
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    s.bind((HOST, PORT))
+    s.listen(4096 if ENGINE == "async" else 128)
+    return s
+
+def serve(s, base_dir: str, graceful: bool = False):
+    # Runs the selected engine on a listening socket. With graceful=True,
+    # SIGTERM stops accepting and lets in-flight requests finish (up to GRACE_SEC).
+    if ENGINE == "async":
+        import server_async
+        server_async.serve(s, base_dir, sys.modules[__name__], graceful)
+        return
+
+    pool = WorkerPool(WORKERS, QUEUE_SIZE, lambda c, a: handle_client(c, a, base_dir), OVERLOAD)
+    pool.start()
+    register_pool_metrics(pool)
+    if POOL_STATS_SEC > 0:
+        threading.Thread(target=report_pool, args=(pool, POOL_STATS_SEC), daemon=True).start()
+
+    stopping = threading.Event()
+    if graceful:
+        def on_term(signum, frame):
+            stopping.set()
+            s.close()   # unblocks accept()
+        signal.signal(signal.SIGTERM, on_term)
+
+    while not stopping.is_set():
+        try:
+            conn, addr = s.accept()
+        except OSError:
+            if stopping.is_set():
+                break
+            raise
+        if not pool.submit(conn, addr):
+            reject_overloaded(conn)
+    pool.wait_idle(GRACE_SEC)
 
 def main():
     if len(sys.argv) != 2:
@@ -316,15 +589,29 @@ def main():
         sys.exit(2)
 
     print(f"[MT] Using {'LOCKED' if USE_LOCK else 'NAIVE'} counters | Delay={DELAY_MS}ms | Rate={RATE_LIMIT}/s per IP")
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        s.bind((HOST, PORT))
-        s.listen(128)
-        print(f"Serving {base_dir} on http://{HOST}:{PORT} ... (multithreaded)")
-        while True:
-            conn, addr = s.accept()
-            t = threading.Thread(target=handle_client, args=(conn, addr, base_dir), daemon=True)
-            t.start()
+    if FILE_CACHE.enabled:
+        print(f"[MT] File cache: {FILE_CACHE.max_bytes} bytes, files up to {FILE_CACHE.max_file_bytes} bytes")
+    if ENGINE != "async":
+        print(f"[MT] Pool: {WORKERS} workers | queue {QUEUE_SIZE} | overload={OVERLOAD}")
+
+    register_metrics()
+    if PROCESSES > 1:
+        import prefork
+        prefork.run(base_dir, sys.modules[__name__])
+        return
+
+    open_hit_store()
+    open_access_log()
+    open_path_index(base_dir)
+    try:
+        with make_listener() as s:
+            mode = "asyncio event loop" if ENGINE == "async" else "multithreaded"
+            print(f"Serving {base_dir} on http://{HOST}:{PORT} ... ({mode})")
+            serve(s, base_dir, graceful=True)   # SIGTERM drains, then the counts are flushed
+    finally:
+        close_path_index()
+        close_access_log()
+        close_hit_store()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
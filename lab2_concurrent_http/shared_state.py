@@ -0,0 +1,129 @@
+# Counters and rate-limit state in anonymous shared memory, for PROCESSES > 1.
+# The tables are created in the parent before forking, so every worker process
+# maps the same pages; each stripe of slots has its own multiprocessing.Lock.
+import hashlib
+import mmap
+import struct
+import time
+
+COUNTER_SLOT = struct.Struct("<QqH")   # key fingerprint, count, key length
+COUNTER_SLOT_SIZE = 256
+KEY_MAX = COUNTER_SLOT_SIZE - COUNTER_SLOT.size   # longer keys are stored truncated
+LIMIT_SLOT = struct.Struct("<Qd")      # ip fingerprint, GCRA theoretical arrival time
+LIMIT_PROBE = 8                        # slots looked at per IP before evicting one
+
+def fingerprint(key: str) -> int:
+    # Stable across processes (unlike hash()); 0 marks an empty slot
+    fp = int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "little")
+    return fp or 1
+
+class _StripedTable:
+    def __init__(self, slots: int, stripes: int, slot_size: int, ctx):
+        self.stripes = max(1, stripes)
+        self.per_stripe = max(1, slots // self.stripes)
+        self.slot_size = slot_size
+        self.buf = mmap.mmap(-1, self.stripes * self.per_stripe * slot_size)   # MAP_SHARED
+        self.locks = [ctx.Lock() for _ in range(self.stripes)]
+
+    def locate(self, fp: int):
+        stripe = fp % self.stripes
+        return self.locks[stripe], stripe * self.per_stripe, (fp // self.stripes) % self.per_stripe
+
+    def offset(self, base: int, home: int, i: int) -> int:
+        return (base + (home + i) % self.per_stripe) * self.slot_size
+
+class SharedCounterTable:
+    # Same interface as counters.ShardedCounter, shared between forked processes
+    def __init__(self, ctx, slots: int = 16384, stripes: int = 64):
+        self.table = _StripedTable(slots, stripes, COUNTER_SLOT_SIZE, ctx)
+        self.dropped = 0   # increments lost because a stripe was full (this process)
+
+    def _find(self, key: str, fp: int, insert: bool) -> int:
+        # Caller holds the stripe lock; returns the slot offset or -1
+        t = self.table
+        _, base, home = t.locate(fp)
+        for i in range(t.per_stripe):
+            off = t.offset(base, home, i)
+            cur = struct.unpack_from("<Q", t.buf, off)[0]
+            if cur == fp:
+                return off
+            if cur == 0:
+                if not insert:
+                    return -1
+                raw = key.encode("utf-8")[:KEY_MAX]
+                COUNTER_SLOT.pack_into(t.buf, off, fp, 0, len(raw))
+                t.buf[off + COUNTER_SLOT.size:off + COUNTER_SLOT.size + len(raw)] = raw
+                return off
+        return -1
+
+    def inc(self, key: str, n: int = 1):
+        fp = fingerprint(key)
+        lock, _, _ = self.table.locate(fp)
+        with lock:
+            off = self._find(key, fp, insert=True)
+            if off < 0:
+                self.dropped += 1
+                return
+            count = struct.unpack_from("<q", self.table.buf, off + 8)[0]
+            struct.pack_into("<q", self.table.buf, off + 8, count + n)
+
+    def get(self, key: str) -> int:
+        fp = fingerprint(key)
+        lock, _, _ = self.table.locate(fp)
+        with lock:
+            off = self._find(key, fp, insert=False)
+            return 0 if off < 0 else struct.unpack_from("<q", self.table.buf, off + 8)[0]
+
+    def snapshot(self) -> dict:
+        t = self.table
+        merged = {}
+        for stripe, lock in enumerate(t.locks):
+            with lock:
+                for i in range(t.per_stripe):
+                    off = (stripe * t.per_stripe + i) * t.slot_size
+                    fp, count, klen = COUNTER_SLOT.unpack_from(t.buf, off)
+                    if fp:
+                        start = off + COUNTER_SLOT.size
+                        key = bytes(t.buf[start:start + klen]).decode("utf-8", "replace")
+                        merged[key] = merged.get(key, 0) + count
+        return merged
+
+    def total(self) -> int:
+        return sum(self.snapshot().values())
+
+class SharedTokenBucketLimiter:
+    # GCRA token bucket like ratelimit.TokenBucketLimiter, in a fixed-size shared
+    # table: an IP probes LIMIT_PROBE slots and, if it is new and none is free,
+    # takes over the one whose bucket is fullest (most idle). Memory is bounded
+    # by construction.
+    def __init__(self, ctx, rate: float, burst: int, slots: int = 65536, stripes: int = 64):
+        self.interval = 1.0 / rate
+        self.tolerance = (max(1, burst) - 1) * self.interval
+        self.table = _StripedTable(slots, stripes, LIMIT_SLOT.size, ctx)
+
+    def limited(self, ip: str) -> bool:
+        t = self.table
+        fp = fingerprint(ip)
+        lock, base, home = t.locate(fp)
+        now = time.monotonic()   # CLOCK_MONOTONIC is system-wide, so comparable across processes
+        with lock:
+            slot, free, oldest, oldest_tat = -1, -1, -1, float("inf")
+            for i in range(min(LIMIT_PROBE, t.per_stripe)):
+                off = t.offset(base, home, i)
+                cur, tat = LIMIT_SLOT.unpack_from(t.buf, off)
+                if cur == fp:
+                    slot = off
+                    break
+                if cur == 0 or tat <= now:      # empty, or a bucket that has fully refilled
+                    if free < 0:
+                        free = off
+                elif tat < oldest_tat:
+                    oldest, oldest_tat = off, tat
+            if slot < 0:
+                slot, tat = (free if free >= 0 else oldest), now
+            tat = max(tat, now)
+            if tat - self.tolerance > now:
+                LIMIT_SLOT.pack_into(t.buf, slot, fp, tat)
+                return True
+            LIMIT_SLOT.pack_into(t.buf, slot, fp, tat + self.interval)
+            return False